@@ -3,4 +3,4 @@ TechGuru package root.
 
 This file makes `app` importable in CI and local dev.
 """
-__all__ = ["agent_core", "code_tools", "srs_scheduler", "scaffolder"]
+__all__ = ["agent_core", "code_tools", "srs_scheduler", "scaffolder", "semantic_cache"]
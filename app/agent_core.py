@@ -9,6 +9,11 @@ Model-env vars supported:
 - GOOGLE_MODEL_DEEP        (preferred model for deep tasks)
 - GOOGLE_MODEL_FAST        (preferred model for fast/light tasks)
 
+Cache-env vars supported:
+- TECHGURU_CACHE_DIR       (response cache directory, default ~/.cache/techguru)
+- TECHGURU_CACHE_TTL       (seconds a cached response stays valid, default 86400; 0 disables)
+- TECHGURU_SEMANTIC_CACHE  (set to 1 to also reuse responses for near-identical source code)
+
 Default preferred models (in order):
 - gemini-2.5-flash-lite
 - gemini-2.0-flash
@@ -18,16 +23,41 @@ it will try alternatives and ultimately fall back to a local stub response.
 """
 import os
 import re
+import atexit
+import functools
 import json
 import time
-from typing import Any, Dict, List, Optional, Tuple
+import random
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
 
-# Safe import of google-genai (optional)
+# Fast JSON (optional orjson) for model responses and the JSON cache tier
 try:
-    from google import genai
-    HAS_GENAI = True
+    import orjson
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
 except Exception:
-    HAS_GENAI = False
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+# Optional persistent backend for the response cache
+try:
+    import diskcache
+    HAS_DISKCACHE = True
+except Exception:
+    HAS_DISKCACHE = False
+
+# google-genai (optional) is imported on the first remote call, in _make_genai_client, so
+# importing this module for tests / offline fallback doesn't load the SDK's protobuf/http stack
+genai = None
 
 # Default model preferences based on your account snapshot
 DEFAULT_PREFERRED = [
@@ -35,7 +65,8 @@ DEFAULT_PREFERRED = [
     "gemini-2.0-flash",
 ]
 
-JSON_CANDIDATE_RE = re.compile(r"(\{[\s\S]*\}|\[[\s\S]*\])", re.MULTILINE)
+# Greedy fallback for _find_json_span; compiled on first use (re caches compiled patterns)
+JSON_CANDIDATE_PATTERN = r"(\{[\s\S]*\}|\[[\s\S]*\])"
 
 def _strip_markdown_fences(text: str) -> str:
     """
@@ -50,6 +81,71 @@ def _strip_markdown_fences(text: str) -> str:
     text = text.replace("`", "")
     return text.strip()
 
+class _JsonSpanScanner:
+    """
+    Finds the first balanced {...} or [...] span in text fed piece by piece (e.g. stream
+    chunks). Scanner state carries over between feeds, so each character is looked at once;
+    braces inside JSON strings are ignored.
+    """
+    def __init__(self):
+        self.consumed = 0
+        self.start = -1  # offset of the opening bracket, once seen
+        self.end = -1    # offset just past the matching close, once seen
+        self._open = self._close = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> bool:
+        """Scan the next piece of text; True once the span is complete."""
+        if self.end >= 0:
+            return True
+        base = self.consumed
+        self.consumed += len(text)
+        i = 0
+        if self.start < 0:
+            starts = [j for j in (text.find("{"), text.find("[")) if j >= 0]
+            if not starts:
+                return False
+            i = min(starts)
+            self.start = base + i
+            self._open = text[i]
+            self._close = "}" if self._open == "{" else "]"
+        depth, in_string, escaped = self._depth, self._in_string, self._escaped
+        for j in range(i, len(text)):
+            c = text[j]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == "\\":
+                    escaped = True
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c == self._open:
+                depth += 1
+            elif c == self._close:
+                depth -= 1
+                if depth == 0:
+                    self.end = base + j + 1
+                    return True
+        self._depth, self._in_string, self._escaped = depth, in_string, escaped
+        return False
+
+def _find_json_span(text: str) -> Optional[str]:
+    """Return the first balanced {...} or [...] span in text, or None (single left-to-right pass)."""
+    scanner = _JsonSpanScanner()
+    return text[scanner.start:scanner.end] if scanner.feed(text) else None
+
+def _json_candidates(text: str):
+    span = _find_json_span(text)
+    if span is not None:
+        yield span
+    m = re.search(JSON_CANDIDATE_PATTERN, text, re.MULTILINE)
+    if m and m.group(1) != span:
+        yield m.group(1)
+
 def extract_json_from_text(text: str) -> Tuple[Optional[object], str]:
     """
     Try to find and parse JSON inside 'text'. Returns (obj, cleaned_text).
@@ -59,27 +155,31 @@ def extract_json_from_text(text: str) -> Tuple[Optional[object], str]:
     if not isinstance(text, str):
         return None, str(text)
 
+    # Happy path: structured-output responses are bare JSON
+    try:
+        return _loads(text), text
+    except Exception:
+        pass
+
     cleaned = _strip_markdown_fences(text)
 
     # First, try whole-string parse
     try:
-        obj = json.loads(cleaned)
+        obj = _loads(cleaned)
         return obj, cleaned
     except Exception:
         pass
 
-    # Search for first {...} or [...] block and try to parse
-    m = JSON_CANDIDATE_RE.search(cleaned)
-    if m:
-        candidate = m.group(1)
+    # Try the first balanced {...} or [...] block, then the (greedy) regex match as a fallback
+    for candidate in _json_candidates(cleaned):
         try:
-            obj = json.loads(candidate)
+            obj = _loads(candidate)
             return obj, candidate
         except Exception:
             # attempt minor fixes: replace single quotes with double quotes (best-effort)
             alt = candidate.replace("'", '"')
             try:
-                obj = json.loads(alt)
+                obj = _loads(alt)
                 return obj, alt
             except Exception:
                 pass
@@ -111,166 +211,1090 @@ ENV_MODEL = os.getenv("GOOGLE_MODEL", "").strip() or None
 ENV_MODEL_DEEP = os.getenv("GOOGLE_MODEL_DEEP", "").strip() or None
 ENV_MODEL_FAST = os.getenv("GOOGLE_MODEL_FAST", "").strip() or None
 
-PREFERRED_MODELS = []
-if ENV_MODEL:
-    PREFERRED_MODELS.append(ENV_MODEL)
-if ENV_MODEL_DEEP:
-    PREFERRED_MODELS.append(ENV_MODEL_DEEP)
-if ENV_MODEL_FAST:
-    PREFERRED_MODELS.append(ENV_MODEL_FAST)
-# then the known defaults
-for m in DEFAULT_PREFERRED:
-    if m not in PREFERRED_MODELS:
-        PREFERRED_MODELS.append(m)
-
-# remove empty/None
-PREFERRED_MODELS = [m for m in PREFERRED_MODELS if m]
-
-# call-time helper to build genai client
-def _make_genai_client():
-    if not HAS_GENAI:
-        return None
-    api_key = os.getenv("GOOGLE_API_KEY")
+# env overrides first, then the known defaults; dict.fromkeys dedups preserving order and
+# filter(None, ...) drops unset overrides
+PREFERRED_MODELS = list(dict.fromkeys(filter(None, [ENV_MODEL, ENV_MODEL_DEEP, ENV_MODEL_FAST, *DEFAULT_PREFERRED])))
+
+# Per-task model orders, built once at import
+_MODELS_DEEP = tuple(dict.fromkeys(filter(None, [ENV_MODEL_DEEP, *PREFERRED_MODELS])))
+# test generation can be token-heavy; prefer DEEP then FAST
+_MODELS_TESTS = tuple(dict.fromkeys(filter(None, [ENV_MODEL_DEEP, ENV_MODEL_FAST, *PREFERRED_MODELS])))
+
+# --- Exact-match response cache ---
+CACHE_DIR = os.path.expanduser(os.getenv("TECHGURU_CACHE_DIR", "").strip() or "~/.cache/techguru")
+CACHE_TTL = int(os.getenv("TECHGURU_CACHE_TTL", "86400") or 0)
+
+class _PromptCache:
+    """
+    Exact-match cache for model responses: an in-memory LRU in front of a persistent disk tier.
+    The disk tier is a diskcache store (SQLite/WAL, safe to share between worker processes)
+    at <path>/, or a JSON file at <path>.json when diskcache isn't installed.
+    Keys are SHA-256 digests of (model_name, prompt[, generation config]); entries expire after `ttl` seconds.
+    Disk errors are swallowed - the cache must never break a model call.
+    """
+    def __init__(self, path: str, maxsize: int = 1024, ttl: int = CACHE_TTL):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._disk = None  # diskcache.Cache or dict (JSON tier), opened lazily
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name: str, prompt: str, config: Optional[Dict[str, Any]] = None) -> str:
+        data = {"m": model_name, "p": prompt}
+        if config:
+            data["c"] = config
+        payload = json.dumps(data, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load_disk(self):
+        if self._disk is None:
+            try:
+                if HAS_DISKCACHE:
+                    self._disk = diskcache.Cache(self.path)
+                else:
+                    with open(f"{self.path}.json", "rb") as f:
+                        self._disk = _loads(f.read())
+            except Exception:
+                self._disk = {}
+        return self._disk
+
+    def _save_disk(self) -> None:
+        # only the JSON tier needs an explicit (whole-file) save
+        if not isinstance(self._disk, dict):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.json.tmp"
+            with open(tmp, "wb") as f:
+                f.write(_dumps(self._disk))
+            os.replace(tmp, f"{self.path}.json")
+        except Exception:
+            pass
+
+    def _disk_get(self, key: str) -> Optional[List[Any]]:
+        try:
+            return self._load_disk().get(key)
+        except Exception:
+            return None
+
+    def _disk_set(self, key: str, expires_at: float, text: str) -> None:
+        disk = self._load_disk()
+        try:
+            if isinstance(disk, dict):
+                disk[key] = [expires_at, text]
+                self._save_disk()
+            else:
+                disk.set(key, [expires_at, text], expire=self.ttl)
+        except Exception:
+            pass
+
+    def get(self, key: str) -> Optional[str]:
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                disk_entry = self._disk_get(key)
+                if disk_entry is not None:
+                    entry = (disk_entry[0], disk_entry[1])
+                    self._mem[key] = entry
+            if entry is not None and entry[0] > now:
+                self._mem.move_to_end(key)
+                self._trim()
+                self.stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                # expired: drop from both tiers
+                self._mem.pop(key, None)
+                try:
+                    self._load_disk().pop(key, None)
+                except Exception:
+                    pass
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, text: str) -> None:
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._mem[key] = (expires_at, text)
+            self._mem.move_to_end(key)
+            self._trim()
+            self._disk_set(key, expires_at, text)
+
+    def _trim(self) -> None:
+        while len(self._mem) > self.maxsize:
+            self._mem.popitem(last=False)
+
+_PROMPT_CACHE = _PromptCache(os.path.join(CACHE_DIR, "llm"))
+
+def get_cache_stats() -> Dict[str, int]:
+    """Return hit/miss counters of the exact-match response cache."""
+    return dict(_PROMPT_CACHE.stats)
+
+# --- Semantic (embedding-similarity) cache, opt-in ---
+SEMANTIC_CACHE_ENABLED = os.getenv("TECHGURU_SEMANTIC_CACHE", "").strip() == "1"
+_SEMANTIC_CACHE = None
+
+def _get_semantic_cache():
+    global _SEMANTIC_CACHE
+    if _SEMANTIC_CACHE is None and SEMANTIC_CACHE_ENABLED:
+        from app.semantic_cache import SemanticCache
+        _SEMANTIC_CACHE = SemanticCache(os.path.join(CACHE_DIR, "semantic_cache"))
+    return _SEMANTIC_CACHE
+
+# Size of the SDK's async HTTP connection pool (shared by every request in the process)
+GENAI_MAX_CONNECTIONS = int(os.getenv("TECHGURU_GENAI_MAX_CONNECTIONS", "100"))
+GENAI_MAX_KEEPALIVE = int(os.getenv("TECHGURU_GENAI_MAX_KEEPALIVE", "50"))
+
+def _http_options() -> Dict[str, Any]:
+    try:
+        import httpx
+    except Exception:
+        return {}
+    limits = httpx.Limits(max_connections=GENAI_MAX_CONNECTIONS, max_keepalive_connections=GENAI_MAX_KEEPALIVE)
+    return {"async_client_args": {"limits": limits}}
+
+# call-time helper to build genai client; memoized per API key so the client and its
+# HTTP connection pool (keep-alive, TLS sessions) are reused across calls
+@functools.lru_cache(maxsize=1)
+def _make_genai_client(api_key: Optional[str]):
+    global genai
     if not api_key:
         return None
+    if genai is None:
+        try:
+            from google import genai as _genai
+        except Exception:
+            return None
+        genai = _genai
     try:
-        return genai.Client(api_key=api_key)
+        client = genai.Client(api_key=api_key, http_options=_http_options())
     except Exception:
+        try:
+            client = genai.Client(api_key=api_key)
+        except Exception:
+            return None
+    if hasattr(client, "close"):
+        atexit.register(client.close)
+    return client
+
+# --- Async model calls with hedged fallback ---
+# A slow primary model gets raced against the next model after HEDGE_DELAY seconds, so
+# latency is roughly min(primary, fallback + delay) instead of the sum of both.
+HEDGE_DELAY = float(os.getenv("TECHGURU_HEDGE_DELAY", "2") or 2)
+
+class _FatalGenaiError(Exception):
+    """An error no retry or other model can fix; its message is returned to the caller."""
+
+class _StreamInterrupted(Exception):
+    """A model failed after part of its answer had been passed on; it can't be retried."""
+
+def _classify_error(e: Exception) -> str:
+    """
+    Map an SDK exception to an action:
+    - "fatal":      bad API key / SDK mismatch - stop everything
+    - "next_model": model missing, not permitted or request rejected (400) - no retry on this model
+    - "backoff":    rate limit / quota (429) - wait and retry
+    - "retry":      5xx, timeouts, connection errors - short pause and retry
+    """
+    # Some SDKs raise TypeError for unexpected kwargs
+    if isinstance(e, TypeError):
+        return "fatal"
+    msg = str(e).lower()
+    if "not found" in msg or "not_supported" in msg or "404" in msg or "permission" in msg or "403" in msg:
+        return "next_model"
+    if "rate" in msg or "quota" in msg or "429" in msg or "resource_exhausted" in msg:
+        return "backoff"
+    if "401" in msg or "unauthenticated" in msg or "api key not valid" in msg or "api_key_invalid" in msg:
+        return "fatal"
+    if "400" in msg or "invalid_argument" in msg:
+        return "next_model"
+    return "retry"
+
+# Servers tell us when to come back via a Retry-After header or a RetryInfo "retryDelay".
+_RETRY_DELAY_RE = re.compile(r"retry[-_ ]?(?:after|delay|in)['\"]?\s*[:=]?\s*['\"]?(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+RETRY_AFTER_MAX = 60.0
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait before retrying, if the exception carries it."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        try:
+            value = headers.get("retry-after")
+            if value:
+                return min(float(value), RETRY_AFTER_MAX)
+        except (TypeError, ValueError):
+            # HTTP-date form or unexpected header object; fall through to the message
+            pass
+    m = _RETRY_DELAY_RE.search(str(e))
+    if m:
+        return min(float(m.group(1)), RETRY_AFTER_MAX)
+    return None
+
+def _backoff_delay(attempt: int, e: Exception) -> float:
+    """Retry-After (plus a little jitter) when given, otherwise full-jitter exponential backoff."""
+    retry_after = _retry_after(e)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.25)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+# --- Per-model circuit breaker ---
+# A model with more than CIRCUIT_MAX_FAILURES failures among its last CIRCUIT_HISTORY attempts
+# (within CIRCUIT_WINDOW seconds) is skipped for CIRCUIT_OPEN_SECONDS. After that a single
+# "half-open" probe request is let through; success closes the circuit, failure keeps it open.
+CIRCUIT_HISTORY = 10
+CIRCUIT_MAX_FAILURES = 5
+CIRCUIT_WINDOW = 60.0
+CIRCUIT_OPEN_SECONDS = 30.0
+_model_health: Dict[str, deque] = {}
+_circuit_open_until: Dict[str, float] = {}
+_CIRCUIT_LOCK = threading.Lock()
+
+def _circuit_allows(model_name: str) -> bool:
+    now = time.time()
+    with _CIRCUIT_LOCK:
+        open_until = _circuit_open_until.get(model_name)
+        if open_until is None:
+            return True
+        if now < open_until:
+            return False
+        # half-open: this request probes, everyone else keeps skipping the model
+        _circuit_open_until[model_name] = now + CIRCUIT_OPEN_SECONDS
+        return True
+
+def _record_outcome(model_name: str, ok: bool) -> None:
+    now = time.time()
+    with _CIRCUIT_LOCK:
+        history = _model_health.setdefault(model_name, deque(maxlen=CIRCUIT_HISTORY))
+        if ok:
+            if _circuit_open_until.pop(model_name, None) is not None:
+                history.clear()
+            history.append((now, True))
+            return
+        history.append((now, False))
+        failures = sum(1 for ts, success in history if not success and now - ts <= CIRCUIT_WINDOW)
+        if failures > CIRCUIT_MAX_FAILURES:
+            _circuit_open_until[model_name] = now + CIRCUIT_OPEN_SECONDS
+
+async def _asdk(client, service: str, method: str, **kwargs):
+    """Call client.aio.<service>.<method>; SDKs without an async surface run the blocking call in a thread."""
+    aio = getattr(client, "aio", None)
+    if aio is not None:
+        return await getattr(getattr(aio, service), method)(**kwargs)
+    return await asyncio.to_thread(getattr(getattr(client, service), method), **kwargs)
+
+# --- Context caching of the static task preambles ---
+# Each task's instruction preamble is uploaded once per (task, model) with client.caches.create
+# and referenced by name, so only the task-specific part of the prompt is sent and prefilled.
+# Models reject caches below a minimum token count, so shorter preambles are sent inline
+# without trying; a create that fails anyway is retried after PREAMBLE_CACHE_RETRY seconds,
+# unless the request itself was rejected (e.g. INVALID_ARGUMENT), which is final.
+PREAMBLE_CACHE_TTL = 3600
+PREAMBLE_CACHE_MIN_TOKENS = 1024
+PREAMBLE_CACHE_RETRY = 300
+_CHARS_PER_TOKEN = 4  # rough estimate for English prose
+_PREAMBLE_CACHE: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+_PREAMBLE_LOCKS: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+async def _preamble_cache_name(client, task: str, model_name: str) -> Optional[str]:
+    """Name of the cached-content handle for task's preamble on model_name, or None to send it inline."""
+    if len(_PREAMBLES[task]) < PREAMBLE_CACHE_MIN_TOKENS * _CHARS_PER_TOKEN:
         return None
+    key = (task, model_name)
+    entry = _PREAMBLE_CACHE.get(key)
+    if entry is not None and time.time() < entry[1]:
+        return entry[0]
+    # one create per key: concurrent first requests wait for it instead of each paying for a cache
+    lock = _PREAMBLE_LOCKS.setdefault(key, asyncio.Lock())
+    async with lock:
+        entry = _PREAMBLE_CACHE.get(key)
+        if entry is not None and time.time() < entry[1]:
+            return entry[0]
+        try:
+            cache = await _asdk(client, "caches", "create", model=model_name, config={
+                "contents": [_PREAMBLES[task]],
+                "ttl": f"{PREAMBLE_CACHE_TTL}s",
+            })
+            # refresh a minute before the server-side TTL runs out
+            entry = (cache.name, time.time() + PREAMBLE_CACHE_TTL - 60)
+        except Exception as e:
+            permanent = _classify_error(e) in ("next_model", "fatal")
+            entry = (None, float("inf") if permanent else time.time() + PREAMBLE_CACHE_RETRY)
+        _PREAMBLE_CACHE[key] = entry
+    return entry[0]
 
-# Generic safe call wrapper with retry/backoff and model fallback
-def _call_gemini_with_fallback(prompt: str,
-                               models: List[str] = None,
-                               short_response: bool = False,
-                               max_attempts_per_model: int = 2) -> str:
+# Tasks whose answer is a single JSON document: a streamed response can stop as soon as
+# the first balanced {...}/[...] block has arrived. Not needed with a response_schema, where
+# the model emits bare JSON that only closes at the very end.
+_JSON_TASKS = {"explain", "bughunt"}
+
+async def _astream_text(client, json_task: bool, on_chunk: Optional[Callable[[str], None]] = None, **kwargs) -> str:
     """
-    Try each model in 'models' list (or PREFERRED_MODELS) until one returns text.
-    Handles common errors (NOT_FOUND for model, rate limit 429) and retries/backoffs.
-    If no client or all models fail, returns offline fallback text.
+    Run generate_content_stream and join the chunk texts once at the end.
+    on_chunk, if given, is called on the event loop with each chunk's text as it arrives.
     """
-    client = _make_genai_client()
-    if client is None:
-        return _offline_stub(prompt)
+    parts: List[str] = []
+    scanner = _JsonSpanScanner() if json_task else None
+    loop = asyncio.get_running_loop()
 
-    # decide the models to try
-    models_to_try = models if models else PREFERRED_MODELS
-    last_exception = None
+    def add(chunk, threaded: bool = False) -> bool:
+        text = getattr(chunk, "text", None)
+        if not text:
+            return False
+        parts.append(text)
+        if on_chunk is not None:
+            if threaded:
+                loop.call_soon_threadsafe(on_chunk, text)
+            else:
+                on_chunk(text)
+        return scanner is not None and scanner.feed(text)
 
-    for model_name in models_to_try:
-        if not model_name:
-            continue
-        for attempt in range(1, max_attempts_per_model + 1):
-            try:
-                # Do a minimal generate_content call; SDKs differ, so be permissive.
-                # We pass model and contents only and rely on SDK for default settings.
-                resp = client.models.generate_content(model=model_name, contents=prompt)
+    aio = getattr(client, "aio", None)
+    if aio is not None:
+        stream = await aio.models.generate_content_stream(**kwargs)
+        try:
+            async for chunk in stream:
+                if add(chunk):
+                    break
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+    else:
+        def consume() -> None:
+            for chunk in client.models.generate_content_stream(**kwargs):
+                if add(chunk, threaded=True):
+                    break
+        await asyncio.to_thread(consume)
+    return "".join(parts)
+
+# --- Service tiers ---
+# "priority" for user-facing calls, "flex" (cheaper, slower) for bulk/CI work, "standard" otherwise.
+# SDKs or models that reject the field flip _SERVICE_TIER_SUPPORTED off and we stop sending it.
+_SERVICE_TIER_SUPPORTED = True
+
+def _is_service_tier_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "service_tier" in msg or "service tier" in msg or "servicetier" in msg
+
+async def _atry_model(client,
+                      model_name: str,
+                      prompt: str,
+                      max_attempts: int,
+                      task: Optional[str] = None,
+                      service_tier: str = "standard",
+                      stream: bool = False,
+                      generation_config: Optional[Dict[str, Any]] = None,
+                      on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Call one model with retries/backoff. Returns text or raises the last exception.
+    With a task, 'prompt' is the task-specific part and the task preamble comes from the context cache.
+    With stream, the response is received incrementally (see _astream_text) and handed to
+    on_chunk as it arrives (a cached answer is handed over whole). Once a chunk has been
+    handed out the attempt is not retried: a failure raises _StreamInterrupted.
+    generation_config is forwarded to generate_content (temperature, response schema, ...).
+    """
+    global _SERVICE_TIER_SUPPORTED
+    full_prompt = _PREAMBLES[task] + prompt if task else prompt
+    # only an explicit temperature of 0 is deterministic: the model's default samples, and
+    # sampled answers differ per call, so they are neither served from nor stored in the cache
+    cacheable = generation_config is not None and generation_config.get("temperature") == 0
+    cache_key = _PromptCache.key(model_name, full_prompt, generation_config)
+    # the cache may hit disk (SQLite / JSON file) under a lock: keep it off the shared event loop
+    cached = await asyncio.to_thread(_PROMPT_CACHE.get, cache_key) if cacheable else None
+    if cached is not None:
+        if on_chunk is not None:
+            on_chunk(cached)
+        return cached
+    answering = False
+
+    def forward(text: str) -> None:
+        nonlocal answering
+        answering = True
+        on_chunk(text)
+
+    last_exception: Optional[Exception] = None
+    for attempt in range(1, max_attempts + 1):
+        cache_name = await _preamble_cache_name(client, task, model_name) if task else None
+        config: Dict[str, Any] = dict(generation_config or {})
+        if cache_name:
+            config["cached_content"] = cache_name
+        if service_tier != "standard" and _SERVICE_TIER_SUPPORTED:
+            config["service_tier"] = service_tier
+        try:
+            # Minimal generate_content call; SDKs differ, so be permissive.
+            request = {"model": model_name, "contents": prompt if cache_name else full_prompt}
+            if config:
+                request["config"] = config
+            if stream:
+                json_task = task in _JSON_TASKS and "response_schema" not in config
+                text = await _astream_text(client, json_task, forward if on_chunk else None, **request)
+            else:
+                resp = await _asdk(client, "models", "generate_content", **request)
                 # resp may have attribute .text or a nested structure; handle common cases
                 text = getattr(resp, "text", None)
                 if text is None:
-                    # Try to convert resp to string
                     text = str(resp)
-                return text
-            except Exception as e:
-                last_exception = e
-                msg = str(e).lower()
-                # If model not found (404 / NOT_FOUND), break to next model immediately
-                if "not found" in msg or "not_supported" in msg or "not_supported" in msg or "404" in msg:
-                    # try next model
-                    break
-                # Rate limit or quota issues - wait and retry a small number of times
-                if "rate" in msg or "quota" in msg or "429" in msg:
-                    backoff = min(2 ** attempt, 8)
-                    time.sleep(backoff)
-                    continue
-                # Some SDKs raise TypeError for unexpected kwargs - treat this as non-fatal and return error string
+            _record_outcome(model_name, True)
+            if cacheable:
+                await asyncio.to_thread(_PROMPT_CACHE.set, cache_key, text)
+            return text
+        except Exception as e:
+            last_exception = e
+            if answering:
+                # chunks were already handed out: a retry (or another model) would repeat them
+                _record_outcome(model_name, False)
+                raise _StreamInterrupted(f"[GENAI ERROR] Stream interrupted: {e!r}") from e
+            if "service_tier" in config and _is_service_tier_error(e):
+                # tier not understood here: fall back to the standard tier for good
+                _SERVICE_TIER_SUPPORTED = False
+                continue
+            if cache_name and "cache" in str(e).lower():
+                # cached preamble expired or was evicted: recreate it on the next attempt
+                _PREAMBLE_CACHE.pop((task, model_name), None)
+                continue
+            action = _classify_error(e)
+            if action != "fatal":
+                _record_outcome(model_name, False)
+            if action == "fatal":
                 if isinstance(e, TypeError):
-                    return f"[GENAI ERROR] SDK TypeError for model={model_name}: {e}"
-                # For other exceptions, try model again a couple times then move on
-                time.sleep(0.5)
+                    raise _FatalGenaiError(f"[GENAI ERROR] SDK TypeError for model={model_name}: {e}") from e
+                raise _FatalGenaiError(f"[GENAI ERROR] Request rejected for model={model_name}: {e}") from e
+            if action == "next_model":
+                break
+            if action == "backoff":
+                await asyncio.sleep(_backoff_delay(attempt, e))
+                continue
+            await asyncio.sleep(0.5)
+    raise last_exception or RuntimeError(f"no attempts made for model={model_name}")
+
+async def _acall_gemini_with_fallback(prompt: str,
+                                      models: Optional[Sequence[str]] = None,
+                                      max_attempts_per_model: int = 4,
+                                      semantic_key: Optional[Tuple[str, str]] = None,
+                                      task: Optional[str] = None,
+                                      service_tier: str = "standard",
+                                      stream: bool = False,
+                                      config: Optional[Dict[str, Any]] = None,
+                                      client=None) -> str:
+    """
+    Async core of _call_gemini_with_fallback. Starts the first model, and whenever no
+    attempt has finished within HEDGE_DELAY (or one has failed) starts the next model too;
+    the first successful response wins and the rest are cancelled. With stream, the delay
+    is measured to the first chunk: once a model is answering it is not hedged any more.
+    Models whose circuit breaker is open are skipped.
+    """
+    client = client or _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+    if client is None:
+        return _offline_stub(_PREAMBLES[task] + prompt if task else prompt)
+
+    semantic = _get_semantic_cache() if semantic_key else None
+    if semantic is not None:
+        # embedding and searching are CPU-bound: run them off the shared event loop
+        hit = await asyncio.to_thread(semantic.lookup, semantic_key[1], namespace=semantic_key[0])
+        if hit is not None:
+            return hit
+
+    # decide the models to try
+    candidates = [m for m in (models if models else PREFERRED_MODELS) if m]
+    remaining = iter(candidates)
+    pending = set()
+    last_exception = None
+    answering: Dict[asyncio.Task, asyncio.Event] = {}
+
+    def launch(model_name: str) -> None:
+        first_chunk = asyncio.Event()
+        attempt = asyncio.create_task(_atry_model(client, model_name, prompt, max_attempts_per_model,
+                                                  task, service_tier, stream, config,
+                                                  lambda text: first_chunk.set()))
+        answering[attempt] = first_chunk
+        pending.add(attempt)
+
+    def launch_next() -> None:
+        for model_name in remaining:
+            if _circuit_allows(model_name):
+                launch(model_name)
+                return
+
+    launch_next()
+    if not pending and candidates:
+        # every circuit is open: try the first model anyway rather than fail without a call
+        launch(candidates[0])
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # current attempts are slow to start: hedge with the next model, keep the others running
+                if not any(answering[t].is_set() for t in pending):
+                    launch_next()
                 continue
-        # exhausted attempts for this model, try next
+            pending -= done
+            for attempt in done:
+                exc = attempt.exception()
+                if exc is None:
+                    text = attempt.result()
+                    if semantic is not None:
+                        await asyncio.to_thread(semantic.add, semantic_key[1], text, namespace=semantic_key[0])
+                    return text
+                if isinstance(exc, _FatalGenaiError):
+                    return str(exc)
+                last_exception = exc
+            launch_next()
+    finally:
+        for attempt in pending:
+            attempt.cancel()
     # All models failed
     return f"[GENAI ERROR] All model attempts failed. Last exception: {repr(last_exception)}"
 
+# All sync callers share one event loop on a daemon thread, so the SDK's async HTTP
+# session (bound to the loop it was created on) stays reusable across calls.
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="techguru-genai", daemon=True).start()
+            _LOOP = loop
+    return _LOOP
+
+def _run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+async def _run_async(coro):
+    """Await coro on the background loop from another event loop (e.g. a web server's)."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _background_loop()))
+
+def open_client():
+    """
+    Create the shared client (and its connection pool) ahead of the first request.
+    Returns None when no API key is configured.
+    """
+    return _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+
+def close_client() -> None:
+    """Close the shared client's connection pools; the next call creates a fresh client."""
+    if not _make_genai_client.cache_info().currsize:
+        return
+    client = open_client()
+    _make_genai_client.cache_clear()
+    if client is None:
+        return
+    aio = getattr(client, "aio", None)
+    if aio is not None and hasattr(aio, "aclose"):
+        try:
+            _run_sync(aio.aclose())
+        except Exception:
+            pass
+    try:
+        client.close()
+    except Exception:
+        pass
+
+# Generic safe call wrapper with retry/backoff and model fallback
+def _call_gemini_with_fallback(prompt: str,
+                               models: Optional[Sequence[str]] = None,
+                               short_response: bool = False,
+                               max_attempts_per_model: int = 4,
+                               semantic_key: Optional[Tuple[str, str]] = None,
+                               task: Optional[str] = None,
+                               service_tier: str = "standard",
+                               stream: bool = False,
+                               config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Try the models in 'models' list (or PREFERRED_MODELS) until one returns text, hedging a
+    slow model with the next one (see _acall_gemini_with_fallback).
+    Handles common errors (NOT_FOUND for model, rate limit 429) and retries/backoffs.
+    Responses are served from / stored in the exact-match cache per (model, prompt).
+    semantic_key: optional (namespace, text) pair; when the semantic cache is enabled, a stored
+    response for a near-identical text in the same namespace is returned without a remote call.
+    task: optional key of _PREAMBLES; 'prompt' is then only the task-specific part and the
+    static preamble is referenced through Gemini context caching.
+    service_tier: "standard", "priority" (interactive) or "flex" (bulk); unsupported tiers
+    silently degrade to standard.
+    stream: receive the response with generate_content_stream; JSON tasks stop reading as soon
+    as a complete JSON block has arrived.
+    config: generation config forwarded to generate_content (e.g. temperature, response_schema);
+    only deterministic responses (config with temperature 0) are cached.
+    If no client or all models fail, returns offline fallback text.
+    """
+    client = _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+    if client is None:
+        return _offline_stub(_PREAMBLES[task] + prompt if task else prompt)
+    return _run_sync(_acall_gemini_with_fallback(prompt,
+                                                 models=models,
+                                                 max_attempts_per_model=max_attempts_per_model,
+                                                 semantic_key=semantic_key,
+                                                 task=task,
+                                                 service_tier=service_tier,
+                                                 stream=stream,
+                                                 config=config,
+                                                 client=client))
+
+async def _acall(prompt: str, **kwargs) -> str:
+    """Async counterpart of _call_gemini_with_fallback, for callers already on an event loop."""
+    client = _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+    if client is None:
+        task = kwargs.get("task")
+        return _offline_stub(_PREAMBLES[task] + prompt if task else prompt)
+    return await _run_async(_acall_gemini_with_fallback(prompt, client=client, **kwargs))
+
+# --- Incremental streaming (first byte at first-token latency) ---
+# Chunks are forwarded as they arrive, so a model can't be hedged or retried once it has
+# started answering: a model that fails before its first chunk falls through to the next one.
+_STREAM_DONE = object()
+
+async def _astream_models(client,
+                          prompt: str,
+                          emit: Callable[[str], None],
+                          models: Optional[Sequence[str]] = None,
+                          max_attempts_per_model: int = 4,
+                          semantic_key: Optional[Tuple[str, str]] = None,
+                          task: Optional[str] = None,
+                          service_tier: str = "standard",
+                          config: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Runs on the background loop; calls emit(text) for every chunk of the first model that answers.
+    Each model gets _atry_model's retries, tier/preamble fallbacks and caching.
+    """
+    semantic = _get_semantic_cache() if semantic_key else None
+    if semantic is not None:
+        hit = await asyncio.to_thread(semantic.lookup, semantic_key[1], namespace=semantic_key[0])
+        if hit is not None:
+            emit(hit)
+            return
+    candidates = [m for m in (models if models else PREFERRED_MODELS) if m]
+    last_exception: Optional[Exception] = None
+
+    def allowed_models():
+        # like the hedged path: skip open circuits, but try the first model if every circuit is open
+        launched = False
+        for model_name in candidates:
+            if _circuit_allows(model_name):
+                launched = True
+                yield model_name
+        if not launched and candidates:
+            yield candidates[0]
+
+    for model_name in allowed_models():
+        try:
+            text = await _atry_model(client, model_name, prompt, max_attempts_per_model,
+                                     task, service_tier, True, config, emit)
+        except _FatalGenaiError as e:
+            emit(str(e))
+            return
+        except _StreamInterrupted as e:
+            emit(f"\n{e}")
+            return
+        except Exception as e:
+            last_exception = e
+            continue
+        if semantic is not None:
+            await asyncio.to_thread(semantic.add, semantic_key[1], text, namespace=semantic_key[0])
+        return
+    emit(f"[GENAI ERROR] All model attempts failed. Last exception: {repr(last_exception)}")
+
+async def _astream(prompt: str, **kwargs) -> AsyncIterator[str]:
+    """Yield response chunks on the caller's event loop while the model streams on the background loop."""
+    client = _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+    if client is None:
+        task = kwargs.get("task")
+        yield _offline_stub(_PREAMBLES[task] + prompt if task else prompt)
+        return
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(item) -> None:
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    future = asyncio.run_coroutine_threadsafe(_astream_models(client, prompt, emit, **kwargs), _background_loop())
+    future.add_done_callback(lambda f: emit(_STREAM_DONE))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _STREAM_DONE:
+                break
+            yield item
+        exc = None if future.cancelled() else future.exception()
+        if exc is not None:
+            yield f"[GENAI ERROR] {exc!r}"
+    finally:
+        # consumer went away (client disconnected): stop reading from the model
+        future.cancel()
+
 def _offline_stub(prompt: str) -> str:
     # Compact simulated fallback; used for tests or when no API key present.
     return f"[FALLBACK] Simulated response (prompt head): {prompt[:300].replace(chr(10),' ')}"
 
-# Convenience wrappers for common agent tasks
-def explain_code(source_code: str, lang: str = "python") -> Dict[str, Any]:
-    """
-    Returns structured explanation. Attempts to parse JSON from model response; otherwise returns a fallback dict.
-    """
-    prompt = (
-        f"You are a senior software instructor. Language: {lang}.\n\n"
+# Prompt builders / response parsers shared by the single-call and batch wrappers.
+# Each prompt is a static task preamble (context-cacheable) followed by the task-specific part.
+_PREAMBLES = {
+    "explain": (
+        "You are a senior software instructor.\n\n"
         "Given the following source code, produce JSON with keys:\n"
         "- summary: 3-sentence high-level summary for a student\n"
         "- line_comments: list of objects {line:int, comment:str} for important lines only\n"
         "- complexity: time/space complexity (informal)\n"
         "- micro_exercises: 3 short practice problems inspired by this code (one-liners)\n\n"
         "Return only valid JSON.\n\n"
-        f"Source code:\n'''{source_code}'''\n"
-    )
-    # prefer DEEP model list (env override or default order)
-    models = []
-    if ENV_MODEL_DEEP:
-        models.append(ENV_MODEL_DEEP)
-    models.extend([m for m in PREFERRED_MODELS if m not in models])
-    out = _call_gemini_with_fallback(prompt, models=models)
+    ),
+    "tests": (
+        "You are an expert test author. Given the following code module, produce a pytest test file.\n"
+        "Create meaningful test cases covering normal and edge cases.\n"
+        "Return only the content of the test file.\n\n"
+    ),
+    "bughunt": (
+        "You are a careful code reviewer. Read the code and:\n"
+        "1) List up to 5 possible bugs or anti-patterns with severity (low/med/high).\n"
+        "2) For each, provide a suggested fix as a unified diff (---/+++ style) if possible.\n"
+        "Return JSON with keys: issues (list of {issue, severity, fix}) and refactor (short paragraph).\n\n"
+    ),
+}
+
+# Deterministic generation config per task. The JSON tasks also use structured output, so the
+# model emits bare JSON matching the schema and no fence stripping / block scanning is needed.
+_EXPLAIN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "line_comments": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"line": {"type": "INTEGER"}, "comment": {"type": "STRING"}},
+                "required": ["line", "comment"],
+            },
+        },
+        "complexity": {"type": "STRING"},
+        "micro_exercises": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["summary", "line_comments", "complexity", "micro_exercises"],
+}
+
+_BUGHUNT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "issues": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "issue": {"type": "STRING"},
+                    "severity": {"type": "STRING", "enum": ["low", "med", "high"]},
+                    "fix": {"type": "STRING"},
+                },
+                "required": ["issue", "severity"],
+            },
+        },
+        "refactor": {"type": "STRING"},
+    },
+    "required": ["issues", "refactor"],
+}
+
+_TASK_CONFIGS = {
+    "explain": {"temperature": 0, "top_p": 1, "response_mime_type": "application/json",
+                "response_schema": _EXPLAIN_SCHEMA},
+    "tests": {"temperature": 0, "top_p": 1},
+    "bughunt": {"temperature": 0, "top_p": 1, "response_mime_type": "application/json",
+                "response_schema": _BUGHUNT_SCHEMA},
+}
+
+def _explain_prompt(source_code: str, lang: str) -> str:
+    return f"Language: {lang}.\n\nSource code:\n'''{source_code}'''\n"
+
+def _tests_prompt(source_code: str, n_tests: int, language: str) -> str:
+    return f"Language: {language}. Number of test cases: {n_tests}.\n\nModule:\n'''{source_code}'''\n"
+
+def _bughunt_prompt(source_code: str) -> str:
+    return f"Code:\n'''{source_code}'''\n"
+
+def _parse_explain(out: str) -> Dict[str, Any]:
     parsed, cleaned = extract_json_from_text(out)
     if parsed and isinstance(parsed, dict):
         return parsed
     # fallback
     return _format_explain_response(out)
 
-def generate_tests(source_code: str, n_tests: int = 5, language: str = "python") -> str:
-    prompt = (
-        "You are an expert test author. Given the following code module, produce a pytest test file.\n"
-        f"Language: {language}. Create {n_tests} meaningful test cases covering normal and edge cases.\n"
-        "Return only the content of the test file.\n\n"
-        f"Module:\n'''{source_code}'''\n"
-    )
-    # test generation can be token-heavy; prefer DEEP then FAST
-    models = []
-    if ENV_MODEL_DEEP:
-        models.append(ENV_MODEL_DEEP)
-    if ENV_MODEL_FAST and ENV_MODEL_FAST not in models:
-        models.append(ENV_MODEL_FAST)
-    models.extend([m for m in PREFERRED_MODELS if m not in models])
-    return _call_gemini_with_fallback(prompt, models=models)
-
-def bug_hunt_and_fix(source_code: str) -> Dict[str, Any]:
-    prompt = (
-        "You are a careful code reviewer. Read the code and:\n"
-        "1) List up to 5 possible bugs or anti-patterns with severity (low/med/high).\n"
-        "2) For each, provide a suggested fix as a unified diff (---/+++ style) if possible.\n"
-        "Return JSON with keys: issues (list) and refactor (short paragraph).\n\n"
-        f"Code:\n'''{source_code}'''\n"
-    )
-    models = []
-    if ENV_MODEL_DEEP:
-        models.append(ENV_MODEL_DEEP)
-    models.extend([m for m in PREFERRED_MODELS if m not in models])
-    out = _call_gemini_with_fallback(prompt, models=models)
+def _parse_bughunt(out: str) -> Dict[str, Any]:
     parsed, cleaned = extract_json_from_text(out)
     if parsed and isinstance(parsed, dict):
         return parsed
     # fallback: return structured with "raw_text"
     return {"issues": [], "raw_text": cleaned}
 
-def scaffold_project(project_name: str = "sample_project", language: str = "python") -> Dict[str, str]:
-    # deterministic lightweight scaffold; doesn't call model (cheap)
-    files = {
+# Convenience wrappers for common agent tasks
+def explain_code(source_code: str, lang: str = "python", service_tier: str = "priority") -> Dict[str, Any]:
+    """
+    Returns structured explanation. Attempts to parse JSON from model response; otherwise returns a fallback dict.
+    """
+    prompt = _explain_prompt(source_code, lang)
+    # prefer DEEP model list (env override or default order)
+    out = _call_gemini_with_fallback(prompt, models=_MODELS_DEEP, semantic_key=(f"explain:{lang}", source_code),
+                                     task="explain", service_tier=service_tier, stream=True,
+                                     config=_TASK_CONFIGS["explain"])
+    return _parse_explain(out)
+
+def generate_tests(source_code: str, n_tests: int = 5, language: str = "python",
+                   service_tier: str = "flex") -> str:
+    prompt = _tests_prompt(source_code, n_tests, language)
+    return _call_gemini_with_fallback(prompt, models=_MODELS_TESTS,
+                                      semantic_key=(f"tests:{language}:{n_tests}", source_code),
+                                      task="tests", service_tier=service_tier, stream=True,
+                                      config=_TASK_CONFIGS["tests"])
+
+def bug_hunt_and_fix(source_code: str, service_tier: str = "priority") -> Dict[str, Any]:
+    prompt = _bughunt_prompt(source_code)
+    out = _call_gemini_with_fallback(prompt, models=_MODELS_DEEP, semantic_key=("bughunt", source_code), task="bughunt",
+                                     service_tier=service_tier, stream=True, config=_TASK_CONFIGS["bughunt"])
+    return _parse_bughunt(out)
+
+# --- Async wrappers (for async web handlers; same caching, hedging and fallback) ---
+# These serve interactive requests, so they default to the priority tier; "flex" stays
+# the default only for the sync CI helper (generate_tests) and the batch wrappers.
+async def explain_code_async(source_code: str, lang: str = "python",
+                             service_tier: str = "priority") -> Dict[str, Any]:
+    out = await _acall(_explain_prompt(source_code, lang), models=_MODELS_DEEP,
+                       semantic_key=(f"explain:{lang}", source_code), task="explain",
+                       service_tier=service_tier, stream=True, config=_TASK_CONFIGS["explain"])
+    return _parse_explain(out)
+
+async def generate_tests_async(source_code: str, n_tests: int = 5, language: str = "python",
+                               service_tier: str = "priority") -> str:
+    return await _acall(_tests_prompt(source_code, n_tests, language), models=_MODELS_TESTS,
+                        semantic_key=(f"tests:{language}:{n_tests}", source_code), task="tests",
+                        service_tier=service_tier, stream=True, config=_TASK_CONFIGS["tests"])
+
+async def bug_hunt_and_fix_async(source_code: str, service_tier: str = "priority") -> Dict[str, Any]:
+    out = await _acall(_bughunt_prompt(source_code), models=_MODELS_DEEP,
+                       semantic_key=("bughunt", source_code), task="bughunt",
+                       service_tier=service_tier, stream=True, config=_TASK_CONFIGS["bughunt"])
+    return _parse_bughunt(out)
+
+def explain_code_stream(source_code: str, lang: str = "python",
+                        service_tier: str = "priority") -> AsyncIterator[str]:
+    """Stream the raw (JSON) explanation text as the model produces it."""
+    return _astream(_explain_prompt(source_code, lang), models=_MODELS_DEEP,
+                    semantic_key=(f"explain:{lang}", source_code), task="explain",
+                    service_tier=service_tier, config=_TASK_CONFIGS["explain"])
+
+def generate_tests_stream(source_code: str, n_tests: int = 5, language: str = "python",
+                          service_tier: str = "priority") -> AsyncIterator[str]:
+    """Stream the generated test code as the model produces it."""
+    return _astream(_tests_prompt(source_code, n_tests, language), models=_MODELS_TESTS,
+                    semantic_key=(f"tests:{language}:{n_tests}", source_code), task="tests",
+                    service_tier=service_tier, config=_TASK_CONFIGS["tests"])
+
+# --- Multi-snippet calls (one model request answers several independent inputs) ---
+# The web layer merges concurrent requests from different users into one of these, so the
+# per-call overhead is paid once. Structured output is kept: the response schema is an ARRAY
+# of the single-input schema and item k answers input k. Inputs the combined answer can't
+# be matched to (wrong length, unparsable) go through the single-call path instead.
+_MULTI_ITEM_SCHEMAS = {"explain": _EXPLAIN_SCHEMA, "bughunt": _BUGHUNT_SCHEMA, "tests": {"type": "STRING"}}
+
+async def _acall_many(task: str,
+                      prompts: Sequence[str],
+                      semantic_keys: Sequence[Tuple[str, str]],
+                      models: Sequence[str],
+                      service_tier: str = "priority") -> List[Optional[str]]:
+    """
+    Answer several task-specific prompts with one model call. Returns one raw response text
+    per prompt (JSON for explain/bughunt, the test file for tests), or None where the caller
+    should make a single call. Items are read from and added to the semantic cache one by one.
+    """
+    results: List[Optional[str]] = [None] * len(prompts)
+    semantic = _get_semantic_cache()
+    if semantic is not None:
+        for i, (namespace, text) in enumerate(semantic_keys):
+            results[i] = await asyncio.to_thread(semantic.lookup, text, namespace=namespace)
+    todo = [i for i, res in enumerate(results) if res is None]
+    if len(todo) < 2:
+        return results
+    prompt = (
+        f"The {len(todo)} inputs below are independent. Apply the instructions above to each one on "
+        f"its own and answer with a JSON array of exactly {len(todo)} results, result k for input k.\n\n"
+        + "".join(f"=== INPUT {k} ===\n{prompts[i]}\n" for k, i in enumerate(todo, 1))
+    )
+    config = dict(_TASK_CONFIGS[task], response_mime_type="application/json",
+                  response_schema={"type": "ARRAY", "items": _MULTI_ITEM_SCHEMAS[task]})
+    out = await _acall(prompt, models=models, task=task, service_tier=service_tier, stream=True, config=config)
+    if out.startswith("[GENAI ERROR]"):
+        # every model failed: single calls would only fail again, len(todo) times over
+        for i in todo:
+            results[i] = out
+        return results
+    parsed, _ = extract_json_from_text(out)
+    if not isinstance(parsed, list) or len(parsed) != len(todo):
+        return results
+    for i, item in zip(todo, parsed):
+        text = item if isinstance(item, str) else json.dumps(item)
+        results[i] = text
+        if semantic is not None:
+            namespace, source = semantic_keys[i]
+            await asyncio.to_thread(semantic.add, source, text, namespace=namespace)
+    return results
+
+async def explain_code_many_async(items: Sequence[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """explain_code_async for several (source_code, lang) pairs, in one model call where possible."""
+    raws = await _acall_many("explain", [_explain_prompt(src, lang) for src, lang in items],
+                             [(f"explain:{lang}", src) for src, lang in items], _MODELS_DEEP)
+
+    async def one(i: int) -> Dict[str, Any]:
+        return _parse_explain(raws[i]) if raws[i] is not None else await explain_code_async(*items[i])
+    return list(await asyncio.gather(*(one(i) for i in range(len(items)))))
+
+async def generate_tests_many_async(items: Sequence[Tuple[str, str]], n_tests: int = 5) -> List[str]:
+    """generate_tests_async for several (source_code, language) pairs, in one model call where possible."""
+    raws = await _acall_many("tests", [_tests_prompt(src, n_tests, language) for src, language in items],
+                             [(f"tests:{language}:{n_tests}", src) for src, language in items], _MODELS_TESTS)
+
+    async def one(i: int) -> str:
+        src, language = items[i]
+        return raws[i] if raws[i] is not None else await generate_tests_async(src, n_tests=n_tests, language=language)
+    return list(await asyncio.gather(*(one(i) for i in range(len(items)))))
+
+async def bug_hunt_and_fix_many_async(sources: Sequence[str]) -> List[Dict[str, Any]]:
+    """bug_hunt_and_fix_async for several sources, in one model call where possible."""
+    raws = await _acall_many("bughunt", [_bughunt_prompt(src) for src in sources],
+                             [("bughunt", src) for src in sources], _MODELS_DEEP)
+
+    async def one(i: int) -> Dict[str, Any]:
+        return _parse_bughunt(raws[i]) if raws[i] is not None else await bug_hunt_and_fix_async(sources[i])
+    return list(await asyncio.gather(*(one(i) for i in range(len(sources)))))
+
+# --- Batch wrappers (Gemini Batch API) ---
+# Batch jobs are billed at roughly half price but may take up to 24h to complete:
+# use them for CI / offline work over many files, never on an interactive request path.
+BATCH_POLL_INTERVAL = 30.0
+BATCH_TIMEOUT = 24 * 3600.0
+_BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+def _call_gemini_batch(prompts: List[str],
+                       model: str,
+                       config: Optional[Dict[str, Any]] = None,
+                       poll_interval: float = BATCH_POLL_INTERVAL,
+                       timeout: float = BATCH_TIMEOUT) -> List[str]:
+    """
+    Submit prompts as one Gemini batch job on 'model' and block until it finishes.
+    Returns one text per prompt (same order). Cached prompts are not resubmitted; items the
+    job failed on come back as "[GENAI ERROR] ..." strings. If the job cannot be created at
+    all, each prompt goes through _call_gemini_with_fallback instead.
+    """
+    client = _make_genai_client(os.getenv("GOOGLE_API_KEY"))
+    if client is None:
+        return [_offline_stub(p) for p in prompts]
+
+    results: List[Optional[str]] = [None] * len(prompts)
+    todo = []
+    cacheable = config is not None and config.get("temperature") == 0  # as in _atry_model
+    for i, prompt in enumerate(prompts):
+        cached = _PROMPT_CACHE.get(_PromptCache.key(model, prompt, config)) if cacheable else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append(i)
+    if not todo:
+        return results
+
+    try:
+        job = client.batches.create(
+            model=model,
+            src=[
+                {"contents": [{"role": "user", "parts": [{"text": prompts[i]}]}], **({"config": config} if config else {})}
+                for i in todo
+            ],
+        )
+    except Exception:
+        for i in todo:
+            results[i] = _call_gemini_with_fallback(prompts[i], models=[model], service_tier="flex", config=config)
+        return results
+
+    deadline = time.time() + timeout
+    state = getattr(job.state, "name", str(job.state))
+    while state not in _BATCH_DONE_STATES and time.time() < deadline:
+        time.sleep(poll_interval)
+        try:
+            job = client.batches.get(name=job.name)
+        except Exception:
+            # transient polling error; keep waiting until the deadline
+            continue
+        state = getattr(job.state, "name", str(job.state))
+
+    dest = getattr(job, "dest", None)
+    responses = list(getattr(dest, "inlined_responses", None) or [])
+    for n, i in enumerate(todo):
+        item = responses[n] if n < len(responses) else None
+        text = getattr(getattr(item, "response", None), "text", None)
+        if text is None:
+            error = getattr(item, "error", None) if item is not None else f"job ended in state {state}"
+            results[i] = f"[GENAI ERROR] Batch item failed for model={model}: {error}"
+            continue
+        if cacheable:
+            _PROMPT_CACHE.set(_PromptCache.key(model, prompts[i], config), text)
+        results[i] = text
+    return results
+
+def explain_code_batch(sources: List[str], lang: str = "python") -> List[Dict[str, Any]]:
+    """Batch version of explain_code (half price, up to 24h latency - CI/offline only)."""
+    model = _MODELS_DEEP[0]
+    outs = _call_gemini_batch([_PREAMBLES["explain"] + _explain_prompt(src, lang) for src in sources],
+                              model=model, config=_TASK_CONFIGS["explain"])
+    return [_parse_explain(out) for out in outs]
+
+def generate_tests_batch(sources: List[str], n_tests: int = 5, language: str = "python") -> List[str]:
+    """Batch version of generate_tests (half price, up to 24h latency - CI/offline only)."""
+    model = _MODELS_TESTS[0]
+    return _call_gemini_batch([_PREAMBLES["tests"] + _tests_prompt(src, n_tests, language) for src in sources],
+                              model=model, config=_TASK_CONFIGS["tests"])
+
+def bug_hunt_and_fix_batch(sources: List[str]) -> List[Dict[str, Any]]:
+    """Batch version of bug_hunt_and_fix (half price, up to 24h latency - CI/offline only)."""
+    model = _MODELS_DEEP[0]
+    outs = _call_gemini_batch([_PREAMBLES["bughunt"] + _bughunt_prompt(src) for src in sources],
+                              model=model, config=_TASK_CONFIGS["bughunt"])
+    return [_parse_bughunt(out) for out in outs]
+
+# Scaffold templates: module constants, built once at import
+_SCAFFOLD_MAIN_PY = "def main():\n    return 'Hello from TechGuru scaffold'\n"
+_SCAFFOLD_TEST_MAIN_PY = (
+    "from src.main import main\n\n"
+    "def test_main():\n"
+    "    assert main() == 'Hello from TechGuru scaffold'\n"
+)
+_SCAFFOLD_PYTEST_INI = "[pytest]\n# the tests import the project package as `src`\npythonpath = .\n"
+_SCAFFOLD_CI_YAML = (
+    "name: CI\non: [push]\njobs:\n  test:\n    runs-on: ubuntu-latest\n    steps:\n      - uses: actions/checkout@v4\n      - uses: actions/setup-python@v4\n        with:\n          python-version: '3.10'\n      - run: pip install -r requirements.txt\n      - run: pytest -q\n"
+)
+
+@functools.lru_cache(maxsize=32)
+def _scaffold_template(project_name: str, language: str) -> Mapping[str, str]:
+    return MappingProxyType({
         f"{project_name}/README.md": f"# {project_name}\n\nGenerated by TechGuru scaffold.",
         f"{project_name}/src/__init__.py": "",
-        f"{project_name}/src/main.py": "def main():\n    return 'Hello from TechGuru scaffold'\n",
-        f"{project_name}/tests/test_main.py": (
-            "from src.main import main\n\n"
-            "def test_main():\n"
-            "    assert main() == 'Hello from TechGuru scaffold'\n"
-        ),
-        f"{project_name}/.github/workflows/ci.yml": (
-            "name: CI\non: [push]\njobs:\n  test:\n    runs-on: ubuntu-latest\n    steps:\n      - uses: actions/checkout@v4\n      - uses: actions/setup-python@v4\n        with:\n          python-version: '3.10'\n      - run: pip install -r requirements.txt\n      - run: pytest -q\n"
-        )
-    }
-    return files
+        f"{project_name}/src/main.py": _SCAFFOLD_MAIN_PY,
+        f"{project_name}/tests/test_main.py": _SCAFFOLD_TEST_MAIN_PY,
+        f"{project_name}/pytest.ini": _SCAFFOLD_PYTEST_INI,
+        f"{project_name}/.github/workflows/ci.yml": _SCAFFOLD_CI_YAML,
+    })
+
+def scaffold_project(project_name: str = "sample_project", language: str = "python") -> Mapping[str, str]:
+    """
+    Deterministic lightweight scaffold; doesn't call model (cheap).
+    Returns a read-only path->content mapping, shared between calls with the same arguments.
+    """
+    return _scaffold_template(project_name, language)
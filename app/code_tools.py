@@ -2,69 +2,228 @@
 Utilities to run pytest on generated test files, apply simple patches (unified diff), and capture results.
 """
 
+import io
 import os
+import re
+import sys
+import shlex
+import atexit
+import asyncio
+import contextlib
+import faulthandler
 import subprocess
 import tempfile
-from typing import Tuple
+import threading
+import multiprocessing
+from typing import List, Optional, Tuple
+
+try:
+    from unidiff import PatchSet
+    from unidiff.constants import LINE_TYPE_NO_NEWLINE
+    HAS_UNIDIFF = True
+except Exception:
+    HAS_UNIDIFF = False
+
+PYTEST_TIMEOUT = 120
+# extra wait for a result after PYTEST_TIMEOUT, by which time a hung worker has exited itself
+PYTEST_KILL_GRACE = 2
+# number of long-lived pytest worker processes (concurrent runs), started on the first run
+PYTEST_WORKERS = max(1, int(os.getenv("TECHGURU_PYTEST_WORKERS", "2") or 1))
+# worker processes are recycled after this many runs to bound leaked state
+PYTEST_TASKS_PER_WORKER = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _warm_worker() -> None:
+    """Pool initializer: pay the pytest import when the worker starts, not on its first run."""
+    try:
+        import pytest  # noqa: F401
+    except Exception:
+        pass
+
+def _run_pytest_inner(project_root: str, timeout: float = PYTEST_TIMEOUT) -> Tuple[int, str]:
+    """
+    Runs inside a pool worker: pytest.main in-process, output captured.
+    A run still going after timeout seconds exits the worker process; the pool replaces
+    it and the other workers (and their runs) are left alone.
+    """
+    import pytest
+
+    root = os.path.abspath(project_root)
+    cwd_before = os.getcwd()
+    path_before = list(sys.path)
+    out = io.StringIO()
+    faulthandler.dump_traceback_later(timeout, exit=True, file=sys.__stderr__)
+    try:
+        os.chdir(root)
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            # the project root goes on sys.path (so tests can import src/) instead of any
+            # pythonpath from an enclosing ini file, which could shadow the project's own src
+            exit_code = int(pytest.main(["-q", "-o", f"pythonpath={shlex.quote(root)}", root]))
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+        os.chdir(cwd_before)
+        sys.path[:] = path_before
+        # forget the project's modules (src, tests, conftest) so the next run sees fresh sources
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, "__file__", None) or ""
+            if os.path.abspath(module_file).startswith(root + os.sep):
+                del sys.modules[name]
+    return exit_code, out.getvalue()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = multiprocessing.get_context(method).Pool(PYTEST_WORKERS, initializer=_warm_worker,
+                                                             maxtasksperchild=PYTEST_TASKS_PER_WORKER)
+            atexit.register(_pool.terminate)
+        return _pool
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
+def stop_pytest_workers() -> None:
+    _reset_pool()
 
 def run_pytest(project_root: str) -> Tuple[int, str]:
     """
     Run pytest in project_root. Returns (exit_code, output).
+    Runs pytest.main in one of PYTEST_WORKERS long-lived worker processes (forkserver pool)
+    instead of spawning a fresh interpreter per call; workers are recycled every
+    PYTEST_TASKS_PER_WORKER runs. A run over PYTEST_TIMEOUT takes down only its own worker.
     """
     if not os.path.isdir(project_root):
         return 1, f"Project root not found: {project_root}"
     try:
+        result = _get_pool().apply_async(_run_pytest_inner, (project_root, PYTEST_TIMEOUT))
+        return result.get(timeout=PYTEST_TIMEOUT + PYTEST_KILL_GRACE)
+    except multiprocessing.TimeoutError:
+        # the hung worker has exited on its own deadline and its result will never arrive
+        return 2, f"Error running pytest: timed out after {PYTEST_TIMEOUT}s"
+    except Exception as e:
+        return 2, f"Error running pytest: {e}"
+
+async def run_pytest_async(project_root: str) -> Tuple[int, str]:
+    """Like run_pytest, but awaits the worker's result instead of blocking a thread on it."""
+    if not os.path.isdir(project_root):
+        return 1, f"Project root not found: {project_root}"
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(setter, value) -> None:
+        if not future.done():
+            setter(value)
+
+    try:
+        # the first run starts the forkserver and workers (~100 ms, under a lock): off the loop
+        pool = _pool or await asyncio.to_thread(_get_pool)
+        pool.apply_async(
+            _run_pytest_inner, (project_root, PYTEST_TIMEOUT),
+            callback=lambda res: loop.call_soon_threadsafe(resolve, future.set_result, res),
+            error_callback=lambda exc: loop.call_soon_threadsafe(resolve, future.set_exception, exc),
+        )
+        return await asyncio.wait_for(future, timeout=PYTEST_TIMEOUT + PYTEST_KILL_GRACE)
+    except asyncio.TimeoutError:
+        return 2, f"Error running pytest: timed out after {PYTEST_TIMEOUT}s"
+    except Exception as e:
+        return 2, f"Error running pytest: {e}"
+
+def _path_in_root(project_root: str, rel_path: str) -> Optional[str]:
+    """Resolved path of rel_path under project_root, or None if it escapes the root (.., absolute, symlinks)."""
+    root = os.path.realpath(project_root)
+    path = os.path.realpath(os.path.join(root, rel_path))
+    return path if path.startswith(root + os.sep) else None
+
+def _hunk_target_lines(hunk) -> List[str]:
+    """Lines the hunk leaves in the file; a '\\ No newline at end of file' marker strips the preceding one."""
+    lines: List[str] = []
+    prev = None
+    for line in hunk:
+        if line.line_type == LINE_TYPE_NO_NEWLINE:
+            if prev is not None and (prev.is_context or prev.is_added):
+                lines[-1] = lines[-1].rstrip("\r\n")
+            continue
+        if line.is_context or line.is_added:
+            lines.append(line.value)
+        prev = line
+    return lines
+
+def _apply_with_unidiff(project_root: str, diff_text: str) -> bool:
+    patch = PatchSet(diff_text)
+    # compute every file first so a bad hunk leaves the tree untouched
+    results = []
+    for patched_file in patch:
+        # diffs come from model output: never touch anything outside project_root
+        target_path = _path_in_root(project_root, patched_file.path)
+        if target_path is None:
+            return False
+        if patched_file.is_removed_file:
+            results.append((target_path, None))
+            continue
+        source = []
+        if not patched_file.is_added_file:
+            with open(target_path, "r", encoding="utf-8") as f:
+                source = f.readlines()
+        # copy untouched ranges, replace each hunk's source range with its target lines
+        out = []
+        pos = 0
+        for hunk in patched_file:
+            start = hunk.source_start - 1 if hunk.source_length else hunk.source_start
+            expected = [line.value for line in hunk if line.is_context or line.is_removed]
+            if [ln.rstrip("\r\n") for ln in source[start:start + hunk.source_length]] != \
+                    [ln.rstrip("\r\n") for ln in expected]:
+                return False
+            out.extend(source[pos:start])
+            out.extend(_hunk_target_lines(hunk))
+            pos = start + hunk.source_length
+        out.extend(source[pos:])
+        results.append((target_path, out))
+    for target_path, out in results:
+        if out is None:
+            try:
+                os.remove(target_path)
+            except FileNotFoundError:
+                pass
+            continue
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        with open(target_path, "w", encoding="utf-8") as f:
+            f.writelines(out)
+    return True
+
+def _apply_with_patch(project_root: str, diff_text: str) -> bool:
+    # -p1 strips the a/ b/ prefixes git-style diffs carry
+    strip = "-p1" if re.search(r"^(---|\+\+\+) [ab]/", diff_text, re.MULTILINE) else "-p0"
+    cmd = ["patch", strip, "--forward", "--batch", "--fuzz=0", "--no-backup-if-mismatch", "-r", "-"]
+    # dry run first so a bad hunk leaves the tree untouched
+    for extra in (["--dry-run"], []):
         proc = subprocess.run(
-            ["pytest", "-q"],
+            cmd + extra,
             cwd=project_root,
+            input=diff_text,
             capture_output=True,
             text=True,
-            timeout=120
+            timeout=30
         )
-        out = proc.stdout + "\n" + proc.stderr
-        return proc.returncode, out
-    except Exception as e:
-        return 2, f"Error running pytest: {e}"
+        if proc.returncode != 0:
+            return False
+    return True
 
 def apply_unified_diff(project_root: str, diff_text: str) -> bool:
     """
-    Apply a very small unified diff to files in project_root.
-    WARNING: This is minimal and intended for simple patches only.
+    Apply a unified diff to files in project_root. Returns True if every hunk applied.
+    Untouched lines are preserved; if any hunk's context does not match, nothing is written.
+    Uses the `unidiff` parser when installed, otherwise the system `patch` tool.
     """
     try:
-        lines = diff_text.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            if line.startswith("--- "):
-                a_path = line[4:].strip()
-                b_line = lines[i+1] if i+1 < len(lines) else ""
-                if b_line.startswith("+++ "):
-                    b_path = b_line[4:].strip()
-                    # unified diffs often include a/ or b/ paths; try both
-                    target = b_path
-                    if target.startswith("a/") or target.startswith("b/"):
-                        target = target[2:]
-                    # collect hunk
-                    i += 2
-                    new_content = []
-                    while i < len(lines) and not lines[i].startswith("--- "):
-                        # naive: skip @@ hunk markers and +/- lines; keep context and '+' adds
-                        ln = lines[i]
-                        if ln.startswith("+") and not ln.startswith("+++"):
-                            new_content.append(ln[1:])
-                        elif ln.startswith(" "):
-                            new_content.append(ln[1:])
-                        i += 1
-                    # write new content
-                    target_path = os.path.join(project_root, target)
-                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                    with open(target_path, "w", encoding="utf-8") as f:
-                        f.write("\n".join(new_content))
-                else:
-                    i += 1
-            else:
-                i += 1
-        return True
+        if HAS_UNIDIFF:
+            return _apply_with_unidiff(project_root, diff_text)
+        return _apply_with_patch(project_root, diff_text)
     except Exception:
         return False
@@ -1,19 +1,27 @@
 # app/scaffolder.py
 """
-Small project scaffolding helper. Produces a dict of path->content.
+Small project scaffolding helper. Produces a read-only mapping of path->content.
 """
-from typing import Dict
+import functools
+from types import MappingProxyType
+from typing import Mapping
 
-def default_scaffold(project_name: str = "project") -> Dict[str, str]:
+_REQUIREMENTS_TXT = "pytest\n"
+_APP_PY = "def greet(name):\n    return f'Hello, {name}'\n"
+_TEST_APP_PY = (
+    "from src.app import greet\n\n"
+    "def test_greet():\n"
+    "    assert greet('TechGuru') == 'Hello, TechGuru'\n"
+)
+
+@functools.lru_cache(maxsize=32)
+def default_scaffold(project_name: str = "project") -> Mapping[str, str]:
     files = {
         f"{project_name}/README.md": f"# {project_name}\n\nScaffolded by TechGuru.",
-        f"{project_name}/requirements.txt": "pytest\n",
+        f"{project_name}/requirements.txt": _REQUIREMENTS_TXT,
         f"{project_name}/src/__init__.py": "",
-        f"{project_name}/src/app.py": "def greet(name):\n    return f'Hello, {name}'\n",
-        f"{project_name}/tests/test_app.py": (
-            "from src.app import greet\n\n"
-            "def test_greet():\n"
-            "    assert greet('TechGuru') == 'Hello, TechGuru'\n"
-        )
+        f"{project_name}/src/app.py": _APP_PY,
+        f"{project_name}/tests/test_app.py": _TEST_APP_PY,
     }
-    return files
+    # cached and shared between callers: hand out a read-only view
+    return MappingProxyType(files)
@@ -0,0 +1,239 @@
+# app/semantic_cache.py
+"""
+Semantic (embedding-similarity) cache for model responses.
+
+Texts are embedded locally with a small SentenceTransformer (all-MiniLM-L6-v2, 384-dim).
+When a new text's cosine similarity to a stored text in the same namespace is >= threshold,
+the stored response is returned instead of calling the remote model.
+
+Entries are persisted as a .npy matrix of embeddings plus a JSON sidecar of
+[namespace, text, response] rows (same order), every SAVE_EVERY adds and at exit
+(or on flush()).
+
+Small namespaces are searched with a brute-force dot product. Once a namespace holds
+HNSW_MIN_ENTRIES entries (and hnswlib is installed) it switches to an HNSW graph index,
+so lookups cost O(log N) instead of O(N*d); the index is saved next to the .npy file.
+
+Optional dependencies: numpy and sentence-transformers (hnswlib for large caches). If numpy
+or sentence-transformers is missing the cache stays inert and every lookup is a miss.
+"""
+import os
+import json
+import atexit
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    np = None
+    HAS_NUMPY = False
+
+try:
+    import hnswlib
+    HAS_HNSWLIB = True
+except Exception:
+    HAS_HNSWLIB = False
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_THRESHOLD = 0.92
+HNSW_MIN_ENTRIES = 10_000
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# unsaved adds before the cache is written to disk again (it is also written at exit)
+SAVE_EVERY = 32
+
+class _Bucket:
+    """Embeddings and entries of a single namespace (e.g. explain:python)."""
+    def __init__(self):
+        self._buf = None  # np.ndarray of shape (capacity, dim); the first count rows are in use
+        self.count = 0
+        self.entries: List[List[str]] = []  # [text, response], parallel to embeddings
+        self.index = None  # hnswlib.Index over embeddings (label = row number), once large enough
+
+    @property
+    def embeddings(self):
+        """np.ndarray of shape (N, dim), rows L2-normalised (a view, no copy)."""
+        return None if self._buf is None else self._buf[:self.count]
+
+    @embeddings.setter
+    def embeddings(self, matrix) -> None:
+        self._buf = np.asarray(matrix, dtype=np.float32)
+        self.count = len(self._buf)
+
+    def append(self, row) -> None:
+        """Add one embedding row; capacity doubles when full, so appends are amortised O(d)."""
+        if self._buf is None:
+            self._buf = np.empty((16, row.shape[0]), dtype=np.float32)
+        elif self.count == len(self._buf):
+            grown = np.empty((2 * len(self._buf), self._buf.shape[1]), dtype=np.float32)
+            grown[:self.count] = self._buf[:self.count]
+            self._buf = grown
+        self._buf[self.count] = row
+        self.count += 1
+
+    def best_match(self, e) -> Tuple[int, float]:
+        """Row and cosine similarity of the stored embedding closest to e."""
+        if self.index is not None:
+            labels, distances = self.index.knn_query(e, k=1)
+            # hnswlib's cosine space returns distance = 1 - similarity
+            return int(labels[0][0]), 1.0 - float(distances[0][0])
+        sims = self.embeddings @ e
+        best = int(sims.argmax())
+        return best, float(sims[best])
+
+class SemanticCache:
+    def __init__(self,
+                 path_prefix: str,
+                 threshold: float = DEFAULT_THRESHOLD,
+                 model_name: str = DEFAULT_MODEL,
+                 encoder: Optional[Callable[[str], Any]] = None):
+        """
+        path_prefix: files are written to <path_prefix>.npy and <path_prefix>.json
+        encoder: optional callable text -> normalised vector (defaults to SentenceTransformer)
+        """
+        self.path_prefix = path_prefix
+        self.npy_path = f"{path_prefix}.npy"
+        self.json_path = f"{path_prefix}.json"
+        self.threshold = threshold
+        self.model_name = model_name
+        self._encoder = encoder
+        self._encoder_failed = False
+        self._buckets: Dict[str, _Bucket] = {}
+        self._loaded = False
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _encode(self, text: str):
+        if not HAS_NUMPY:
+            return None
+        if self._encoder is None:
+            if self._encoder_failed:
+                return None
+            try:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name)
+                self._encoder = lambda t: model.encode(t, normalize_embeddings=True)
+            except Exception:
+                self._encoder_failed = True
+                return None
+        try:
+            return np.asarray(self._encoder(text), dtype=np.float32).ravel()
+        except Exception:
+            return None
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+            embeddings = np.load(self.npy_path)
+        except Exception:
+            return
+        if len(rows) != len(embeddings):
+            return
+        for namespace in dict.fromkeys(row[0] for row in rows):
+            idx = [i for i, row in enumerate(rows) if row[0] == namespace]
+            bucket = self._buckets.setdefault(namespace, _Bucket())
+            bucket.embeddings = embeddings[idx]
+            bucket.entries = [[rows[i][1], rows[i][2]] for i in idx]
+            self._ensure_index(namespace, bucket)
+
+    def _index_path(self, namespace: str) -> str:
+        digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:12]
+        return f"{self.path_prefix}.{digest}.hnsw"
+
+    def _ensure_index(self, namespace: str, bucket: _Bucket) -> None:
+        """Load or build the namespace's HNSW index once it is large enough."""
+        if bucket.index is not None or not HAS_HNSWLIB or len(bucket.entries) < HNSW_MIN_ENTRIES:
+            return
+        n, dim = bucket.embeddings.shape
+        index = hnswlib.Index(space="cosine", dim=dim)
+        path = self._index_path(namespace)
+        try:
+            index.load_index(path, max_elements=max(2 * n, HNSW_MIN_ENTRIES))
+            if index.get_current_count() != n:
+                raise ValueError("stale index")
+        except Exception:
+            index = hnswlib.Index(space="cosine", dim=dim)
+            index.init_index(max_elements=max(2 * n, HNSW_MIN_ENTRIES),
+                             ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+            index.add_items(bucket.embeddings, np.arange(n))
+        index.set_ef(HNSW_EF_SEARCH)
+        bucket.index = index
+
+    def _save(self) -> None:
+        rows = []
+        matrices = []
+        for namespace, bucket in self._buckets.items():
+            if bucket.embeddings is None:
+                continue
+            rows.extend([namespace, text, response] for text, response in bucket.entries)
+            matrices.append(bucket.embeddings)
+        try:
+            # write everything to temp files first, then swap them in: a crash or a concurrent
+            # reader never sees a half-written file (and _load rejects a mismatched pair)
+            os.makedirs(os.path.dirname(self.npy_path) or ".", exist_ok=True)
+            with open(f"{self.npy_path}.tmp", "wb") as f:
+                np.save(f, np.vstack(matrices))
+            with open(f"{self.json_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+            indexes = [(self._index_path(namespace), bucket.index)
+                       for namespace, bucket in self._buckets.items() if bucket.index is not None]
+            for path, index in indexes:
+                index.save_index(f"{path}.tmp")
+            os.replace(f"{self.npy_path}.tmp", self.npy_path)
+            os.replace(f"{self.json_path}.tmp", self.json_path)
+            for path, _ in indexes:
+                os.replace(f"{path}.tmp", path)
+        except Exception:
+            pass
+
+    def flush(self) -> None:
+        """Write pending adds to disk now."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+                self._unsaved = 0
+
+    def lookup(self, text: str, namespace: str = "") -> Optional[str]:
+        """Return the stored response for the most similar text in namespace, if close enough."""
+        e = self._encode(text)
+        if e is None:
+            return None
+        with self._lock:
+            self._load()
+            bucket = self._buckets.get(namespace)
+            if bucket is None or bucket.embeddings is None:
+                return None
+            best, sim = bucket.best_match(e)
+            if sim >= self.threshold:
+                return bucket.entries[best][1]
+        return None
+
+    def add(self, text: str, response: str, namespace: str = "") -> None:
+        e = self._encode(text)
+        if e is None:
+            return
+        with self._lock:
+            self._load()
+            bucket = self._buckets.setdefault(namespace, _Bucket())
+            bucket.append(e)
+            bucket.entries.append([text, response])
+            if bucket.index is not None:
+                label = len(bucket.entries) - 1
+                if label >= bucket.index.get_max_elements():
+                    bucket.index.resize_index(2 * bucket.index.get_max_elements())
+                bucket.index.add_items(e[None, :], np.array([label]))
+            else:
+                self._ensure_index(namespace, bucket)
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY:
+                self._save()
+                self._unsaved = 0
@@ -1,30 +1,87 @@
 # app/srs_scheduler.py
+"""
+Spaced-repetition scheduler backed by SQLite (WAL mode).
+
+Scheduling a topic is a single INSERT OR REPLACE of its row instead of rewriting the whole
+state file, and concurrent readers/writers don't clobber each other. A legacy srs_state.json
+next to the database is imported once when the database is first opened.
+"""
 import os
 import json
+import sqlite3
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, Any
 
-STATE_FILE = "srs_state.json"
+STATE_FILE = "srs_state.db"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS srs("
+    "topic TEXT PRIMARY KEY, last_quality INT, next_review TEXT, scheduled_at TEXT)"
+)
+
+# sqlite3 connections must not be shared across threads: keep one per (thread, state_file)
+_local = threading.local()
+
+def _import_legacy_json(conn: sqlite3.Connection, json_file: str) -> None:
+    # EAFP: a single open() instead of exists()+open(), and no race between the two
+    try:
+        with open(json_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        # missing, unreadable or corrupt legacy file: nothing to import
+        return
+    try:
+        # rows already in the database are newer than the legacy file
+        conn.executemany(
+            "INSERT OR IGNORE INTO srs(topic, last_quality, next_review, scheduled_at) VALUES (?, ?, ?, ?)",
+            [(topic, row.get("last_quality"), row.get("next_review"), row.get("scheduled_at"))
+             for topic, row in state.items()],
+        )
+    except Exception:
+        pass
+
+def _connect(state_file: str) -> sqlite3.Connection:
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(state_file)
+    if conn is None:
+        conn = sqlite3.connect(state_file, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        _import_legacy_json(conn, os.path.splitext(state_file)[0] + ".json")
+        conns[state_file] = conn
+    return conn
 
 def schedule_task(topic: str, quality: int = 3, state_file: str = STATE_FILE) -> Dict[str, Any]:
     """
     quality: 0-5 where higher means better recall. returns next review date.
     """
-    try:
-        state = {}
-        if os.path.exists(state_file):
-            with open(state_file, "r", encoding="utf-8") as f:
-                state = json.load(f)
-    except Exception:
-        state = {}
-
     # simple scheduling: next_review = now + days where days = max(1, 2^(5-quality))
     days = max(1, 2 ** max(0, 5 - quality))
     next_review = (datetime.utcnow() + timedelta(days=days)).isoformat()
-    state[topic] = {"last_quality": quality, "next_review": next_review, "scheduled_at": datetime.utcnow().isoformat()}
     try:
-        with open(state_file, "w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
-    except Exception:
+        _connect(state_file).execute(
+            "INSERT OR REPLACE INTO srs(topic, last_quality, next_review, scheduled_at) VALUES (?, ?, ?, ?)",
+            (topic, quality, next_review, datetime.utcnow().isoformat()),
+        )
+    except sqlite3.Error:
         pass
     return {"topic": topic, "next_review": next_review, "quality": quality}
+
+def load_state(state_file: str = STATE_FILE) -> Dict[str, Dict[str, Any]]:
+    """
+    Return all scheduled topics as {topic: {last_quality, next_review, scheduled_at}}.
+    """
+    try:
+        rows = _connect(state_file).execute(
+            "SELECT topic, last_quality, next_review, scheduled_at FROM srs ORDER BY topic"
+        ).fetchall()
+    except sqlite3.Error:
+        return {}
+    return {
+        topic: {"last_quality": quality, "next_review": next_review, "scheduled_at": scheduled_at}
+        for topic, quality, next_review, scheduled_at in rows
+    }
@@ -7,12 +7,35 @@ Improved FastAPI demo for TechGuru:
 import os
 import json
 import asyncio
-import traceback
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
+import time
+import codecs
+import hashlib
+import uuid
+import queue
+import logging
+import functools
+from logging.handlers import QueueHandler, QueueListener
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Dict, Any
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, Any, Awaitable, Callable, Hashable, List, Tuple
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    HAS_ORJSON = False
+
+try:
+    from servestatic import ServeStaticASGI
+    HAS_SERVESTATIC = True
+except Exception:
+    HAS_SERVESTATIC = False
 
 # load dotenv if present
 try:
@@ -24,41 +47,326 @@ except Exception:
 # Import agent modules
 from app import agent_core, code_tools, scaffolder, srs_scheduler
 
-app = FastAPI(title="TechGuru Demo API")
+# Paths, resolved once at import
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+_STATIC_DIR = os.path.join(_THIS_DIR, "static")
+_CHAT_HTML_PATH = os.path.join(_STATIC_DIR, "chat.html")
+_IMAGES_DIR = os.path.abspath(os.path.join(_THIS_DIR, "..", "Images"))
+_DATA_BASE_DIR = os.path.abspath(os.path.join(_THIS_DIR, "..", "data", "sample_projects"))
+
+# Failures are logged with their traceback under a short error id; clients only get the id.
+# Records are queued as-is and formatted (traceback included) on the listener's thread, so a
+# failing request never formats tracebacks or writes logs on the event loop.
+log = logging.getLogger("techguru")
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+# While the app's lifespan runs, records are queued and formatted/written by a listener thread;
+# outside it (no listener to drain a queue) they propagate to the root logger as usual.
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_handler = _DeferredQueueHandler(_log_queue)
+_log_listener = None
+
+def _start_log_listener() -> None:
+    global _log_listener
+    if _log_listener is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        _log_listener = QueueListener(_log_queue, handler)
+        _log_listener.start()
+        log.addHandler(_log_handler)
+        log.propagate = False
+
+def _stop_log_listener() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        log.removeHandler(_log_handler)
+        log.propagate = True
+        _log_listener.stop()  # drains what is already queued
+        _log_listener = None
+
+def _log_failure(what: str) -> str:
+    """Log the exception being handled under a new error id and return the id."""
+    error_id = uuid.uuid4().hex[:12]
+    log.exception("%s [error id %s]", what, error_id)
+    return error_id
+
+# Blocking work (file writes, client setup) runs on a bounded thread pool so the event loop
+# keeps serving other requests. Model calls and pytest runs are awaited directly.
+AGENT_WORKERS = int(os.getenv("TECHGURU_AGENT_WORKERS", "8"))
+_executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix="techguru-agent")
+    return _executor
+
+async def _run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _executor
+    _start_log_listener()
+    # open the shared model client (one keep-alive connection pool) before the first request
+    await _run_blocking(agent_core.open_client)
+    yield
+    await _run_blocking(agent_core.close_client)
+    await _run_blocking(code_tools.stop_pytest_workers)
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    _stop_log_listener()
+
+# Request batching: concurrent requests to the same agent endpoint are collected for up to
+# BATCH_WINDOW_MS (or BATCH_MAX_SIZE distinct requests) and answered by one multi-snippet
+# model call; identical requests in a batch share one slot. 0 disables the window.
+BATCH_WINDOW_MS = float(os.getenv("TECHGURU_BATCH_WINDOW_MS", "50") or 0)
+BATCH_MAX_SIZE = 16
+
+class _RequestBatcher:
+    """Coalesce concurrent submit() calls into one handler call over the distinct items."""
+    def __init__(self, handler: Callable[[List[Hashable]], Awaitable[List[Any]]],
+                 max_batch_size: int = BATCH_MAX_SIZE, max_queue_time: float = BATCH_WINDOW_MS / 1000):
+        self._handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self._pending: Dict[Hashable, List[asyncio.Future]] = {}
+        self._timer = None
+
+    async def submit(self, item: Hashable) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.setdefault(item, []).append(fut)
+        if len(self._pending) >= self.max_batch_size or self.max_queue_time <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_queue_time, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._handler(list(batch)))
+            task.add_done_callback(functools.partial(self._resolve, list(batch.values())))
+
+    @staticmethod
+    def _resolve(waiters: List[List[asyncio.Future]], task: asyncio.Future) -> None:
+        results = None if task.cancelled() or task.exception() is not None else task.result()
+        for i, futs in enumerate(waiters):
+            for fut in futs:
+                if fut.done():
+                    continue  # the client went away
+                if task.cancelled():
+                    fut.cancel()
+                elif results is None:
+                    fut.set_exception(task.exception())
+                else:
+                    fut.set_result(results[i])
+
+# resolved at call time so the agent functions can be swapped (tests, reloads)
+_BATCHERS = {
+    "explain": _RequestBatcher(lambda items: agent_core.explain_code_many_async(items)),
+    "generate-tests": _RequestBatcher(lambda items: agent_core.generate_tests_many_async(items, n_tests=5)),
+    "bughunt": _RequestBatcher(lambda items: agent_core.bug_hunt_and_fix_many_async([code for code, _ in items])),
+}
+
+# In-process result cache in front of the batchers: a repeat request for the same snippet is
+# answered without prompt building, a model round-trip or response parsing.
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = int(os.getenv("TECHGURU_RESULT_CACHE_TTL", "3600") or 0)
+
+class _ResultCache:
+    """LRU of agent results keyed by (mode, blake2b(code), lang); entries expire after ttl seconds."""
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: int = RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, bytes, str], Tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def key(mode: str, code: str, lang: str) -> Tuple[str, bytes, str]:
+        return mode, hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest(), lang
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+_RESULT_CACHE = _ResultCache()
+
+def _is_error_result(res: Any) -> bool:
+    values = res.values() if isinstance(res, dict) else [res]
+    return any(isinstance(v, str) and v.startswith("[GENAI ERROR]") for v in values)
+
+async def _agent_result(mode: str, code: str, lang: str = "python") -> Any:
+    key = _ResultCache.key(mode, code, lang)
+    res = _RESULT_CACHE.get(key)
+    if res is None:
+        res = await _BATCHERS[mode].submit((code, lang))
+        if not _is_error_result(res):
+            _RESULT_CACHE.set(key, res)
+    return res
+
+class _JSONResponse(JSONResponse):
+    """Default response class: rendered with orjson (several times faster) when installed."""
+    def render(self, content: Any) -> bytes:
+        if HAS_ORJSON:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return super().render(content)
+
+def _parse_json_body(raw: bytes) -> Dict[str, Any]:
+    """Parse a request body once; empty, malformed or non-object bodies give {}."""
+    if not raw:
+        return {}
+    try:
+        body = orjson.loads(raw) if HAS_ORJSON else json.loads(raw)
+    except ValueError:  # orjson.JSONDecodeError and json.JSONDecodeError are both ValueErrors
+        return {}
+    return body if isinstance(body, dict) else {}
+
+# Largest accepted request body; code pastes beyond this would be truncated by the model anyway
+MAX_BODY_BYTES = int(os.getenv("TECHGURU_MAX_BODY_BYTES", "65536"))
+
+class _BodySizeLimit:
+    """
+    Answer 413 to request bodies over max_bytes before any route reads them: by
+    Content-Length up front, or, for bodies sent without one (chunked), by reading them
+    here first and replaying them to the app once they are known to fit.
+    """
+    def __init__(self, app, max_bytes: int = MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit():
+            if int(length) > self.max_bytes:
+                await self._reject(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+            return
+        messages = []
+        received = 0
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                await self._reject(scope, receive, send)
+                return
+            if not message.get("more_body", False):
+                break
+
+        async def replay():
+            return messages.pop(0) if messages else await receive()
+
+        await self.app(scope, replay, send)
 
-# Static chat UI
-static_dir = os.path.join(os.path.dirname(__file__), "static")
-if os.path.isdir(static_dir):
-    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    async def _reject(self, scope, receive, send) -> None:
+        response = _JSONResponse({"error": f"payload too large (max {self.max_bytes} bytes)"}, status_code=413)
+        await response(scope, receive, send)
+
+class _SelectiveGZip:
+    """
+    GZipMiddleware for everything except the excluded path prefixes: streamed responses
+    (gzip would buffer their chunks) and already-compressed static images.
+    """
+    def __init__(self, app, exclude_prefixes: Tuple[str, ...] = (), **gzip_kwargs):
+        self.app = app
+        self.gzip = GZipMiddleware(app, **gzip_kwargs)
+        self.exclude_prefixes = tuple(exclude_prefixes)
 
-    @app.get("/chat", response_class=HTMLResponse)
-    def chat_ui():
-        html_path = os.path.join(static_dir, "chat.html")
-        if os.path.exists(html_path):
-            return FileResponse(html_path, media_type="text/html")
-        return HTMLResponse("<html><body><h3>Chat UI not found</h3></body></html>", status_code=404)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(self.exclude_prefixes):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
 
-# Mount Images
-images_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "Images"))
-if os.path.isdir(images_path):
-    app.mount("/images", StaticFiles(directory=images_path), name="images")
+# Routes are collected on a router; create_app() assembles the application around it.
+router = APIRouter()
 
 # Helper: stream chunks of text
-async def _text_chunker(text: str, chunk_size: int = 120, delay: float = 0.01, max_total: int = 20000):
-    """Yield small chunks of text with a slight delay to simulate streaming."""
+# Each chunk is one ASGI send (one write, often one TCP segment): ~1400 fits an Ethernet MTU.
+# Override with TECHGURU_STREAM_FLUSH_THRESHOLD.
+STREAM_FLUSH_THRESHOLD = int(os.getenv("TECHGURU_STREAM_FLUSH_THRESHOLD", "1400"))
+
+async def _text_chunker(text: str, chunk_size: int = STREAM_FLUSH_THRESHOLD, delay: float = 0.0,
+                        max_total: int = 20000):
+    """
+    Yield MTU-sized chunks of the UTF-8 encoded text; delay > 0 paces them (simulated typing).
+    The text is encoded once and chunks are zero-copy memoryview slices of it.
+    """
     if not isinstance(text, str):
         text = str(text)
     if len(text) > max_total:
         text = text[:max_total] + "\n\n[TRUNCATED: response exceeded max length]"
-    i = 0
-    while i < len(text):
-        chunk = text[i:i+chunk_size]
-        i += chunk_size
-        yield chunk
-        await asyncio.sleep(delay)
+    data = memoryview(text.encode("utf-8"))
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def _stream_frames(chunks, flush_threshold: int = 0, max_total: int = 20000):
+    """
+    Forward an (async) iterable of text pieces as they are produced. Pieces are coalesced until
+    flush_threshold characters are buffered (0: forward each piece as is) and the stream is cut
+    after max_total characters.
+    """
+    buf = []
+    size = total = 0
+    try:
+        if hasattr(chunks, "__aiter__"):
+            pieces = chunks
+        else:
+            async def pieces_of(it):
+                for piece in it:
+                    yield piece
+            pieces = pieces_of(chunks)
+        async for piece in pieces:
+            if total + len(piece) > max_total:
+                buf.append(piece[:max_total - total] + "\n\n[TRUNCATED: response exceeded max length]")
+                break
+            total += len(piece)
+            size += len(piece)
+            buf.append(piece)
+            if size >= flush_threshold:
+                yield "".join(buf)
+                buf, size = [], 0
+    except Exception:
+        buf.append(f"\n[ERROR {_log_failure('stream failed')}] Agent failed")
+    if buf:
+        yield "".join(buf)
 
 # Simple endpoint to report which model env is configured (helpful for UI/debug)
-@app.get("/model")
+@router.get("/model")
 def model_info():
     return {
         "GOOGLE_API_KEY_set": bool(os.getenv("GOOGLE_API_KEY")),
@@ -67,143 +375,208 @@ def model_info():
         "GOOGLE_MODEL_FAST": os.getenv("GOOGLE_MODEL_FAST")
     }
 
+# Streamed responses must reach the client as produced: tell browsers/CDNs not to cache them and
+# nginx (X-Accel-Buffering) not to buffer them. Other proxies need buffering switched off in
+# their own config (nginx: proxy_buffering off; gzip off).
+_STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def _sse_events(chunks):
+    """Re-frame text chunks as server-sent events: one 'data:' line per text line, per chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        # memoryview chunks may end inside a multi-byte character: decode incrementally
+        text = chunk if isinstance(chunk, str) else decoder.decode(bytes(chunk))
+        if text:
+            yield "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield f"data: {tail}\n\n"
+
 # Streaming endpoint (mode + payload)
-@app.post("/stream")
+@router.post("/stream")
 async def stream_endpoint(request: Request):
     """
     POST JSON: { "mode": "explain"|"generate-tests"|"bughunt"|"scaffold", "payload": {...} }
-    Returns a streaming plain-text response (chunked).
+    Returns a streaming plain-text response (chunked), or server-sent events when the client
+    sends Accept: text/event-stream. explain and generate-tests forward the model's output as it
+    is generated (explain as raw JSON); bughunt streams its JSON result.
     """
-    try:
-        body = await request.json()
-    except Exception:
-        body = await request.body()
-        try:
-            body = json.loads(body)
-        except Exception:
-            body = {}
+    body = _parse_json_body(await request.body())
 
     mode = body.get("mode", "explain")
     payload = body.get("payload", {}) or {}
 
     try:
         if mode == "generate-tests":
-            text = agent_core.generate_tests(payload.get("code", ""), n_tests=5, language=payload.get("lang", "python"))
+            chunks = _stream_frames(agent_core.generate_tests_stream(payload.get("code", ""), n_tests=5,
+                                                                     language=payload.get("lang", "python")))
         elif mode == "bughunt":
-            res = agent_core.bug_hunt_and_fix(payload.get("code", ""))
-            text = json.dumps(res, indent=2)
+            res = await _agent_result("bughunt", payload.get("code", ""))
+            chunks = _stream_frames(json.JSONEncoder(indent=2).iterencode(res), flush_threshold=STREAM_FLUSH_THRESHOLD)
         elif mode == "scaffold":
             files = agent_core.scaffold_project(payload.get("project_name", "sample_project"))
-            text = "Scaffolded files:\n" + "\n".join(files.keys())
+            chunks = _text_chunker("Scaffolded files:\n" + "\n".join(files.keys()))
         else:  # explain
-            res = agent_core.explain_code(payload.get("code", ""), lang=payload.get("lang", "python"))
-            if isinstance(res, dict) and "summary" in res:
-                parts = [f"Summary:\n{res.get('summary')}\n"]
-                if res.get("line_comments"):
-                    parts.append("Line comments:")
-                    for lc in res["line_comments"]:
-                        parts.append(f"  line {lc.get('line')}: {lc.get('comment')}")
-                if res.get("micro_exercises"):
-                    parts.append("\nMicro exercises:")
-                    for ex in res["micro_exercises"]:
-                        parts.append(f"  - {ex}")
-                text = "\n".join(parts)
-            else:
-                text = str(res)
-    except Exception as e:
-        tb = traceback.format_exc()
-        text = f"[ERROR] Agent failed: {e}\n\n{tb}"
+            chunks = _stream_frames(agent_core.explain_code_stream(payload.get("code", ""),
+                                                                   lang=payload.get("lang", "python")))
+    except Exception:
+        chunks = _text_chunker(f"[ERROR {_log_failure(f'stream {mode} failed')}] Agent failed")
 
-    return StreamingResponse(_text_chunker(text), media_type="text/plain; charset=utf-8")
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(_sse_events(chunks), media_type="text/event-stream", headers=_STREAM_HEADERS)
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8", headers=_STREAM_HEADERS)
 
 
 # Request models
+# frozen + extra="ignore": unknown keys are dropped without being kept on the instance
 class CodeIn(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
     code: str
     lang: str = "python"
 
 class ScaffoldIn(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
     project_name: str = "sample_project"
 
 
-@app.post("/explain")
-def explain(body: CodeIn):
+@router.post("/explain")
+async def explain(body: CodeIn):
     try:
-        res = agent_core.explain_code(body.code, lang=body.lang)
+        res = await _agent_result("explain", body.code, body.lang)
         return res
-    except Exception as e:
-        return {"error": str(e)}
+    except Exception:
+        return {"error": f"Agent failed (error id {_log_failure('explain failed')})"}
 
-@app.post("/generate-tests")
-def generate_tests(body: CodeIn):
+@router.post("/generate-tests")
+async def generate_tests(body: CodeIn):
     try:
-        test_text = agent_core.generate_tests(body.code, n_tests=5, language=body.lang)
+        test_text = await _agent_result("generate-tests", body.code, body.lang)
         return {"tests": test_text}
-    except Exception as e:
-        return {"error": str(e)}
+    except Exception:
+        return {"error": f"Agent failed (error id {_log_failure('generate-tests failed')})"}
 
-@app.post("/bughunt")
-def bughunt(body: CodeIn):
+@router.post("/bughunt")
+async def bughunt(body: CodeIn):
     try:
-        res = agent_core.bug_hunt_and_fix(body.code)
+        res = await _agent_result("bughunt", body.code)
         return res
-    except Exception as e:
-        return {"error": str(e)}
+    except Exception:
+        return {"error": f"Agent failed (error id {_log_failure('bughunt failed')})"}
+
+def _scaffold_roots(project_name: str) -> List[str]:
+    """Directories the scaffold is written to: demo/<name> and data/sample_projects/<name>."""
+    demo_dir = os.path.join(_THIS_DIR, project_name)
+    data_dir = os.path.join(_DATA_BASE_DIR, project_name)
+    # the data copy may be a symlink to the demo copy: don't write the same files twice
+    if os.path.realpath(data_dir) == os.path.realpath(demo_dir):
+        return [demo_dir]
+    return [demo_dir, data_dir]
+
+def _make_dirs(dirs) -> None:
+    """makedirs each distinct directory once, shallowest first, so every call creates at most one level."""
+    for d in sorted(set(dirs), key=lambda d: (d.count(os.sep), d)):
+        os.makedirs(d, exist_ok=True)
 
-@app.post("/scaffold")
-def scaffold(body: ScaffoldIn):
+def _write_file(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+async def _write_scaffold(project_name: str, files: Dict[str, str]) -> None:
+    """Write every file into each scaffold root; the writes run concurrently on the thread pool."""
+    targets = []
+    for rel_path, content in files.items():
+        parts = rel_path.split("/", 1)
+        subpath = parts[1] if len(parts) == 2 else parts[0]
+        targets.extend((os.path.join(root, subpath), content) for root in _scaffold_roots(project_name))
+    # one makedirs per distinct directory, before any write starts
+    await _run_blocking(_make_dirs, {os.path.dirname(path) for path, _ in targets})
+    await asyncio.gather(*(_run_blocking(_write_file, path, content) for path, content in targets))
+
+@router.post("/scaffold")
+async def scaffold(body: ScaffoldIn):
     try:
         files = agent_core.scaffold_project(body.project_name)
-        demo_dir = os.path.join(os.path.dirname(__file__), body.project_name)
-        data_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'sample_projects', body.project_name)
-        os.makedirs(demo_dir, exist_ok=True)
-        os.makedirs(data_dir, exist_ok=True)
-        for rel_path, content in files.items():
-            parts = rel_path.split("/", 1)
-            subpath = parts[1] if len(parts) == 2 else parts[0]
-            # write demo copy
-            demo_full = os.path.join(demo_dir, subpath)
-            os.makedirs(os.path.dirname(demo_full), exist_ok=True)
-            with open(demo_full, "w", encoding="utf-8") as f:
-                f.write(content)
-            # write data copy
-            data_full = os.path.join(data_dir, subpath)
-            os.makedirs(os.path.dirname(data_full), exist_ok=True)
-            with open(data_full, "w", encoding="utf-8") as f:
-                f.write(content)
+        await _write_scaffold(body.project_name, files)
         return {"files_written": list(files.keys()), "demo_dir": f"demo/{body.project_name}", "data_dir": f"data/sample_projects/{body.project_name}"}
-    except Exception as e:
-        tb = traceback.format_exc()
-        raise HTTPException(status_code=500, detail=f"Scaffold failed: {e}\n\n{tb}")
+    except Exception:
+        raise HTTPException(status_code=500, detail=f"Scaffold failed (error id {_log_failure('scaffold failed')})")
 
-@app.get("/run-tests")
-def run_tests(project: str = "sample_project"):
-    project_root = os.path.join(os.path.dirname(__file__), project)
+@router.get("/run-tests")
+async def run_tests(project: str = "sample_project"):
+    project_root = os.path.join(_THIS_DIR, project)
     if not os.path.isdir(project_root):
         raise HTTPException(status_code=404, detail=f"Project not found: {project_root}")
-    code, out = code_tools.run_pytest(project_root)
+    code, out = await code_tools.run_pytest_async(project_root)
     return {"exit_code": code, "output": out}
 
 
 # Friendly root page
-@app.get("/", response_class=HTMLResponse)
-def root():
-    banner_url = "/images/banner_1.png" if os.path.exists(os.path.join(images_path, "banner_1.png")) else ""
-    html = f"""
-    <html>
-      <head>
-        <title>TechGuru - Demo</title>
-        <meta charset="utf-8" />
-      </head>
-      <body style="font-family: Inter, Roboto, Arial; background:#0b1220; color:#e6eef8; text-align:center; padding:30px;">
-        <div style="max-width:900px; margin: auto;">
-          {f'<img src="{banner_url}" alt="TechGuru banner" style="max-width:100%; height:auto; border-radius:8px; margin-bottom:20px;" />' if banner_url else '<h1>TechGuru</h1>'}
-          <h2 style="color:#9bdcff; margin-top:8px;">Your AI Pair-Programmer That Actually Teaches You</h2>
-          <p style="color:#cfeffd; font-size:16px;">Interactive API docs: <a href="/docs">/docs (Swagger UI)</a></p>
-          <p style="margin-top:24px; color:#a9cfe6;">API endpoints: <code>/explain</code>, <code>/generate-tests</code>, <code>/bughunt</code>, <code>/scaffold</code>, <code>/run-tests</code></p>
-          <div style="margin-top:28px; font-size:13px; color:#92bfdc">Demo server running on <strong>127.0.0.1:8000</strong></div>
-        </div>
-      </body>
-    </html>
+def _root_page(banner_url: str) -> bytes:
+    return f"""
+<html>
+  <head>
+    <title>TechGuru - Demo</title>
+    <meta charset="utf-8" />
+  </head>
+  <body style="font-family: Inter, Roboto, Arial; background:#0b1220; color:#e6eef8; text-align:center; padding:30px;">
+    <div style="max-width:900px; margin: auto;">
+      {f'<img src="{banner_url}" alt="TechGuru banner" style="max-width:100%; height:auto; border-radius:8px; margin-bottom:20px;" />' if banner_url else '<h1>TechGuru</h1>'}
+      <h2 style="color:#9bdcff; margin-top:8px;">Your AI Pair-Programmer That Actually Teaches You</h2>
+      <p style="color:#cfeffd; font-size:16px;">Interactive API docs: <a href="/docs">/docs (Swagger UI)</a></p>
+      <p style="margin-top:24px; color:#a9cfe6;">API endpoints: <code>/explain</code>, <code>/generate-tests</code>, <code>/bughunt</code>, <code>/scaffold</code>, <code>/run-tests</code></p>
+      <div style="margin-top:28px; font-size:13px; color:#92bfdc">Demo server running on <strong>127.0.0.1:8000</strong></div>
+    </div>
+  </body>
+</html>
+""".encode("utf-8")
+
+_ROOT_HEADERS = {"Cache-Control": "public, max-age=3600"}
+
+def _chat_ui():
+    return FileResponse(_CHAT_HTML_PATH, media_type="text/html")
+
+def _chat_ui_missing():
+    return HTMLResponse("<html><body><h3>Chat UI not found</h3></body></html>", status_code=404)
+
+# Mount Images. ServeStatic indexes the files once at startup and serves them with ETag and
+# Cache-Control headers (and any pre-built .gz/.br variants); StaticFiles is the fallback.
+# File names aren't content-hashed, so browsers revalidate daily rather than caching forever.
+IMAGES_MAX_AGE = 86400
+
+def create_app(serve_static: bool = True) -> FastAPI:
     """
-    return HTMLResponse(content=html)
+    Build the demo application. All filesystem probes (static/ and Images/ mounts, chat page,
+    banner) happen here, once per process; serve_static=False skips them entirely.
+    """
+    app = FastAPI(title="TechGuru Demo API", lifespan=lifespan, default_response_class=_JSONResponse)
+    # JSON answers (code comments, pytest output) compress 3-4x
+    app.add_middleware(_SelectiveGZip, exclude_prefixes=("/stream", "/images/"), minimum_size=500)
+    # outermost: oversize bodies are turned away before anything else runs
+    app.add_middleware(_BodySizeLimit, max_bytes=MAX_BODY_BYTES)
+    app.include_router(router)
+
+    banner_url = ""
+    if serve_static and os.path.isdir(_STATIC_DIR):
+        app.mount("/static", StaticFiles(directory=_STATIC_DIR), name="static")
+        chat = _chat_ui if os.path.isfile(_CHAT_HTML_PATH) else _chat_ui_missing
+        app.add_api_route("/chat", chat, methods=["GET"], response_class=HTMLResponse)
+    if serve_static and os.path.isdir(_IMAGES_DIR):
+        if HAS_SERVESTATIC:
+            app.mount("/images", ServeStaticASGI(None, root=_IMAGES_DIR, prefix="/images/", max_age=IMAGES_MAX_AGE),
+                      name="images")
+        else:
+            app.mount("/images", StaticFiles(directory=_IMAGES_DIR), name="images")
+        if os.path.exists(os.path.join(_IMAGES_DIR, "banner_1.png")):
+            banner_url = "/images/banner_1.png"
+
+    # built once: the banner check and HTML formatting are off the request path
+    root_body = _root_page(banner_url)
+
+    def root():
+        # a fresh Response wrapping the prebuilt body: middleware (gzip) edits response headers in place
+        return HTMLResponse(content=root_body, headers=_ROOT_HEADERS)
+
+    app.add_api_route("/", root, methods=["GET"], response_class=HTMLResponse)
+    return app
+
+app = create_app()
@@ -0,0 +1,40 @@
+# run.py
+"""
+Production entrypoint for the demo API:
+
+    python run.py
+
+Runs uvicorn with the uvloop event loop and the httptools HTTP parser (both come with
+uvicorn[standard]; plain asyncio/h11 are used if they are missing), WEB_CONCURRENCY worker
+processes (default: 1, which suits small instances like Render's free plan; raise it where
+memory allows), a large accept backlog and a cap on concurrent connections
+so a burst queues in the kernel instead of piling up in the app.
+
+Environment: HOST (0.0.0.0), PORT (8000), WEB_CONCURRENCY (1), TECHGURU_LIMIT_CONCURRENCY (256),
+TECHGURU_LIMIT_MAX_REQUESTS (10000 requests per worker before it is replaced; 0 disables).
+For development use `uvicorn demo.demo_fastapi:app --reload` instead.
+"""
+import os
+import importlib.util
+
+import uvicorn
+
+def _has(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def main() -> None:
+    uvicorn.run(
+        "demo.demo_fastapi:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop" if _has("uvloop") else "asyncio",
+        http="httptools" if _has("httptools") else "h11",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1") or 1),
+        backlog=4096,
+        limit_concurrency=int(os.getenv("TECHGURU_LIMIT_CONCURRENCY", "256")),
+        # recycle workers periodically to bound slow memory growth
+        limit_max_requests=int(os.getenv("TECHGURU_LIMIT_MAX_REQUESTS", "10000")) or None,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 # tests/test_agent_core.py
 import os
 import json
+import time
+import pytest
+from collections.abc import Mapping
+from types import SimpleNamespace
 from app import agent_core
 
 def test_explain_fallback():
@@ -16,5 +20,442 @@ def test_explain_fallback():
 
 def test_scaffold_structure():
     files = agent_core.scaffold_project("demo_proj")
-    assert isinstance(files, dict)
+    assert isinstance(files, Mapping)
     assert any(k.endswith("README.md") for k in files.keys())
+
+class _FakeModels:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, model, contents, **kwargs):
+        self.calls += 1
+        return type("Resp", (), {"text": f"{model}: {contents}"})()
+
+    def generate_content_stream(self, model, contents, **kwargs):
+        text = self.generate_content(model, contents, **kwargs).text
+        half = len(text) // 2
+        yield SimpleNamespace(text=text[:half])
+        yield SimpleNamespace(text=text[half:])
+
+class _FakeClient:
+    def __init__(self):
+        self.models = _FakeModels()
+
+@pytest.mark.parametrize("use_diskcache", [True, False])
+def test_prompt_cache_serves_repeat_calls(tmp_path, monkeypatch, use_diskcache):
+    if use_diskcache and not agent_core.HAS_DISKCACHE:
+        pytest.skip("diskcache not installed")
+    monkeypatch.setattr(agent_core, "HAS_DISKCACHE", use_diskcache)
+    cache = agent_core._PromptCache(str(tmp_path / "llm"), ttl=60)
+    client = _FakeClient()
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", cache)
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    first = agent_core._call_gemini_with_fallback("hello", models=["m1"], config={"temperature": 0})
+    second = agent_core._call_gemini_with_fallback("hello", models=["m1"], config={"temperature": 0})
+    assert first == second == "m1: hello"
+    assert client.models.calls == 1
+    assert cache.stats == {"hits": 1, "misses": 1}
+    # disk tier survives a fresh in-memory cache
+    reloaded = agent_core._PromptCache(cache.path, ttl=60)
+    assert reloaded.get(agent_core._PromptCache.key("m1", "hello", {"temperature": 0})) == "m1: hello"
+
+def test_semantic_cache_matches_near_identical_text(tmp_path):
+    np = pytest.importorskip("numpy")
+    from app.semantic_cache import SemanticCache
+
+    def encoder(text):
+        # bag-of-characters embedding: good enough to tell near-duplicates apart
+        v = np.zeros(128, dtype=np.float32)
+        for ch in text:
+            v[ord(ch) % 128] += 1
+        return v / np.linalg.norm(v)
+
+    cache = SemanticCache(str(tmp_path / "semantic"), encoder=encoder)
+    cache.add("def add(a, b):\n    return a + b", "adds numbers", namespace="explain:python")
+    assert cache.lookup("def add(a, b):\n    return a+b", namespace="explain:python") == "adds numbers"
+    assert cache.lookup("def add(a, b):\n    return a + b", namespace="bughunt") is None
+    assert cache.lookup("class Stack: pass", namespace="explain:python") is None
+    cache.flush()
+    reloaded = SemanticCache(str(tmp_path / "semantic"), encoder=encoder)
+    assert reloaded.lookup("def add(a, b):\n    return a + b", namespace="explain:python") == "adds numbers"
+    assert not list(tmp_path.glob("*.tmp"))
+
+def test_slow_model_is_hedged_with_fallback(tmp_path, monkeypatch):
+    client = _FakeClient()
+    fast = client.models.generate_content
+
+    def generate_content(model, contents, **kwargs):
+        if model == "slow":
+            time.sleep(0.5)
+        return fast(model, contents, **kwargs)
+
+    client.models.generate_content = generate_content
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "HEDGE_DELAY", 0.05)
+    assert agent_core._call_gemini_with_fallback("hi", models=["slow", "quick"]) == "quick: hi"
+
+def test_backoff_honours_retry_after_and_jitters():
+    class RateLimited(Exception):
+        response = type("Resp", (), {"headers": {"retry-after": "3"}})()
+
+    assert 3 <= agent_core._backoff_delay(1, RateLimited("429")) <= 3.25
+    details = Exception("429 RESOURCE_EXHAUSTED {'retryDelay': '12s'}")
+    assert 12 <= agent_core._backoff_delay(1, details) <= 12.25
+    delays = [agent_core._backoff_delay(5, Exception("429")) for _ in range(50)]
+    assert all(0 <= d <= agent_core.BACKOFF_CAP for d in delays)
+    assert len(set(delays)) > 1
+
+def test_circuit_breaker_skips_failing_model(monkeypatch):
+    monkeypatch.setattr(agent_core, "_model_health", {})
+    monkeypatch.setattr(agent_core, "_circuit_open_until", {})
+    for _ in range(agent_core.CIRCUIT_MAX_FAILURES):
+        agent_core._record_outcome("flaky", False)
+    assert agent_core._circuit_allows("flaky")
+    agent_core._record_outcome("flaky", False)
+    assert not agent_core._circuit_allows("flaky")
+    # once the open period is over a single half-open probe is let through
+    agent_core._circuit_open_until["flaky"] = time.time() - 1
+    assert agent_core._circuit_allows("flaky")
+    assert not agent_core._circuit_allows("flaky")
+    agent_core._record_outcome("flaky", True)
+    assert agent_core._circuit_allows("flaky")
+
+def test_batch_submits_one_job_and_parses_each_result(tmp_path, monkeypatch):
+    submitted = []
+
+    class FakeBatches:
+        def create(self, model, src):
+            submitted.append(src)
+            responses = [
+                SimpleNamespace(response=SimpleNamespace(text='{"summary": "item %d"}' % i), error=None)
+                for i in range(len(src))
+            ]
+            return SimpleNamespace(name="batches/1", state="JOB_STATE_SUCCEEDED",
+                                   dest=SimpleNamespace(inlined_responses=responses))
+
+    client = _FakeClient()
+    client.batches = FakeBatches()
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=60))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    res = agent_core.explain_code_batch(["a = 1", "b = 2"])
+    assert [r["summary"] for r in res] == ["item 0", "item 1"]
+    assert len(submitted) == 1 and len(submitted[0]) == 2
+    # cached results are not resubmitted
+    agent_core.explain_code_batch(["a = 1", "b = 2"])
+    assert len(submitted) == 1
+
+def test_task_preamble_is_sent_through_context_cache(tmp_path, monkeypatch):
+    seen = []
+
+    class FakeCaches:
+        def create(self, model, config):
+            return SimpleNamespace(name=f"cachedContents/{model}")
+
+    client = _FakeClient()
+    client.caches = FakeCaches()
+    client.models.generate_content = lambda model, contents, **kw: seen.append((contents, kw)) or \
+        SimpleNamespace(text='{"issues": [], "refactor": "ok"}')
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    monkeypatch.setattr(agent_core, "_PREAMBLE_CACHE", {})
+    monkeypatch.setattr(agent_core, "PREAMBLE_CACHE_MIN_TOKENS", 0)
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    assert agent_core.bug_hunt_and_fix("x = 1")["refactor"] == "ok"
+    contents, kwargs = seen[0]
+    assert "careful code reviewer" not in contents and "x = 1" in contents
+    assert kwargs["config"]["cached_content"].startswith("cachedContents/")
+    assert kwargs["config"]["service_tier"] == "priority"
+
+def test_preamble_cache_creation_is_shared_and_retried(monkeypatch):
+    import asyncio
+    creates = []
+    outcomes = [RuntimeError("503 UNAVAILABLE"), SimpleNamespace(name="cachedContents/m1")]
+
+    class FakeCaches:
+        def create(self, model, config):
+            creates.append(model)
+            time.sleep(0.05)
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+    client = SimpleNamespace(caches=FakeCaches())
+    monkeypatch.setattr(agent_core, "_PREAMBLE_CACHE", {})
+    monkeypatch.setattr(agent_core, "_PREAMBLE_LOCKS", {})
+    monkeypatch.setattr(agent_core, "PREAMBLE_CACHE_MIN_TOKENS", 0)
+
+    async def three():
+        return await asyncio.gather(*(agent_core._preamble_cache_name(client, "tests", "m1") for _ in range(3)))
+    # concurrent first requests share one (failed, transient) create
+    assert asyncio.run(three()) == [None, None, None] and creates == ["m1"]
+    # ... and it is retried once PREAMBLE_CACHE_RETRY has passed
+    name, retry_at = agent_core._PREAMBLE_CACHE[("tests", "m1")]
+    assert name is None and retry_at <= time.time() + agent_core.PREAMBLE_CACHE_RETRY
+    agent_core._PREAMBLE_CACHE[("tests", "m1")] = (None, time.time() - 1)
+    assert asyncio.run(agent_core._preamble_cache_name(client, "tests", "m1")) == "cachedContents/m1"
+    # preambles below the model minimum are sent inline without a create call
+    monkeypatch.setattr(agent_core, "PREAMBLE_CACHE_MIN_TOKENS", 1024)
+    assert asyncio.run(agent_core._preamble_cache_name(client, "tests", "m2")) is None
+    assert creates == ["m1", "m1"]
+    # a rejected request (e.g. below the model's minimum) is not retried
+    outcomes.append(RuntimeError("400 INVALID_ARGUMENT: cached content is too small"))
+    monkeypatch.setattr(agent_core, "PREAMBLE_CACHE_MIN_TOKENS", 0)
+    assert asyncio.run(agent_core._preamble_cache_name(client, "tests", "m3")) is None
+    assert agent_core._PREAMBLE_CACHE[("tests", "m3")][1] == float("inf")
+
+def test_unsupported_service_tier_degrades_to_standard(tmp_path, monkeypatch):
+    client = _FakeClient()
+    fast = client.models.generate_content
+
+    def generate_content(model, contents, **kwargs):
+        if "service_tier" in kwargs.get("config", {}):
+            raise TypeError("unexpected field service_tier")
+        return fast(model, contents, **kwargs)
+
+    client.models.generate_content = generate_content
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    monkeypatch.setattr(agent_core, "_SERVICE_TIER_SUPPORTED", True)
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    out = agent_core._call_gemini_with_fallback("hi", models=["m1"], service_tier="flex")
+    assert out == "m1: hi"
+    assert agent_core._SERVICE_TIER_SUPPORTED is False
+
+def test_extract_json_picks_first_balanced_block():
+    text = 'Here you go: {"summary": "uses {braces} in strings", "n": [1, 2]} and also {"other": 1}'
+    obj, raw = agent_core.extract_json_from_text(text)
+    assert obj == {"summary": "uses {braces} in strings", "n": [1, 2]}
+    assert agent_core._find_json_span("no json here") is None
+    assert agent_core._find_json_span('{"unterminated": [1, 2') is None
+
+def test_streamed_json_stops_after_first_complete_block(tmp_path, monkeypatch):
+    client = _FakeClient()
+
+    def generate_content_stream(model, contents, **kwargs):
+        yield SimpleNamespace(text='```json\n{"issues": [], ')
+        yield SimpleNamespace(text='"refactor": "fine"}\n')
+        raise AssertionError("stream read past the JSON block")
+
+    client.models.generate_content_stream = generate_content_stream
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    # without a response_schema the model may wrap or trail the JSON, so reading stops early
+    out = agent_core._call_gemini_with_fallback("x = 1", models=["m1"], task="bughunt", stream=True,
+                                                config={"temperature": 0})
+    assert agent_core._parse_bughunt(out) == {"issues": [], "refactor": "fine"}
+
+def test_json_span_scanner_keeps_state_across_chunks():
+    scanner = agent_core._JsonSpanScanner()
+    chunks = ['pre {"a": "x\\', '"}", "b": [1', ', 2]', '} tail']
+    assert [scanner.feed(c) for c in chunks] == [False, False, False, True]
+    text = "".join(chunks)
+    assert text[scanner.start:scanner.end] == '{"a": "x\\"}", "b": [1, 2]}'
+    assert agent_core._find_json_span(text) == text[scanner.start:scanner.end]
+
+def test_scaffold_is_cached_and_read_only():
+    files = agent_core.scaffold_project("demo_proj")
+    assert agent_core.scaffold_project("demo_proj") is files
+    with pytest.raises(TypeError):
+        files["demo_proj/extra.py"] = ""
+
+def test_semantic_cache_switches_to_hnsw_index(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("hnswlib")
+    from app import semantic_cache
+
+    monkeypatch.setattr(semantic_cache, "HNSW_MIN_ENTRIES", 8)
+    vectors = {f"snippet {i}": np.eye(16, dtype=np.float32)[i] for i in range(10)}
+    cache = semantic_cache.SemanticCache(str(tmp_path / "semantic"), encoder=lambda t: vectors[t])
+    for text in vectors:
+        cache.add(text, text.upper())
+    assert cache._buckets[""].index is not None
+    assert cache.lookup("snippet 9") == "SNIPPET 9"
+    cache.flush()
+    reloaded = semantic_cache.SemanticCache(str(tmp_path / "semantic"), encoder=lambda t: vectors[t])
+    assert reloaded.lookup("snippet 3") == "SNIPPET 3"
+    assert reloaded._buckets[""].index is not None
+
+def test_async_wrappers_run_from_foreign_loop(tmp_path, monkeypatch):
+    import asyncio
+    client = _FakeClient()
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "_MODELS_TESTS", ("m1",))
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    # awaited from another event loop (like a web server's), answered on the background loop
+    out = asyncio.run(agent_core.generate_tests_async("x = 1"))
+    assert out.startswith("m1: ") and "x = 1" in out
+
+def test_stream_yields_chunks_as_they_arrive(tmp_path, monkeypatch):
+    import asyncio
+    client = _FakeClient()
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "_MODELS_TESTS", ("m1",))
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=60))
+
+    async def collect():
+        return [c async for c in agent_core.generate_tests_stream("x = 1")]
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 2 and "".join(chunks).startswith("m1: ")
+    # the joined stream was cached: a repeat is served whole, without another model call
+    again = asyncio.run(collect())
+    assert again == ["".join(chunks)] and client.models.calls == 1
+
+def test_streaming_model_is_not_hedged_once_answering(tmp_path, monkeypatch):
+    client = _FakeClient()
+    called = []
+
+    def generate_content_stream(model, contents, **kwargs):
+        called.append(model)
+        yield SimpleNamespace(text=f"{model}: ")
+        time.sleep(0.3)  # slow to finish, but already answering
+        yield SimpleNamespace(text="done")
+
+    client.models.generate_content_stream = generate_content_stream
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "HEDGE_DELAY", 0.05)
+    out = agent_core._call_gemini_with_fallback("hi", models=["slow", "quick"], stream=True)
+    assert out == "slow: done" and called == ["slow"]
+
+def test_semantic_cache_saves_every_few_adds(tmp_path, monkeypatch):
+    np = pytest.importorskip("numpy")
+    from app import semantic_cache
+
+    monkeypatch.setattr(semantic_cache, "SAVE_EVERY", 5)
+    vectors = {f"snippet {i}": np.eye(40, dtype=np.float32)[i] for i in range(40)}
+    cache = semantic_cache.SemanticCache(str(tmp_path / "semantic"), encoder=lambda t: vectors[t])
+    for i in range(4):
+        cache.add(f"snippet {i}", str(i))
+    assert not os.path.exists(cache.npy_path)
+    for i in range(4, 37):
+        cache.add(f"snippet {i}", str(i))
+    # 35 entries on disk; the last 2 are written by flush() (or at exit)
+    assert len(np.load(cache.npy_path)) == 35
+    assert cache.lookup("snippet 36") == "36"
+    cache.flush()
+    reloaded = semantic_cache.SemanticCache(str(tmp_path / "semantic"), encoder=lambda t: vectors[t])
+    assert reloaded.lookup("snippet 36") == "36" and reloaded._buckets[""].count == 37
+
+def test_stream_retries_before_first_chunk_and_stops_on_fatal(tmp_path, monkeypatch):
+    import asyncio
+    client = _FakeClient()
+    calls = []
+
+    def generate_content_stream(model, contents, **kwargs):
+        calls.append(model)
+        if len(calls) == 1:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+        yield SimpleNamespace(text=f"{model}: ok")
+
+    client.models.generate_content_stream = generate_content_stream
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "_MODELS_TESTS", ("m1", "m2"))
+    monkeypatch.setattr(agent_core, "_backoff_delay", lambda attempt, e: 0)
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+
+    async def collect():
+        return [c async for c in agent_core.generate_tests_stream("x = 1")]
+    # rate limited before answering: the same model is retried, like the non-streaming path
+    assert asyncio.run(collect()) == ["m1: ok"] and calls == ["m1", "m1"]
+
+    def rejected(model, contents, **kwargs):
+        calls.append(model)
+        raise RuntimeError("401 API key not valid")
+        yield
+    client.models.generate_content_stream = rejected
+    calls.clear()
+    out = asyncio.run(collect())
+    assert len(out) == 1 and out[0].startswith("[GENAI ERROR] Request rejected") and calls == ["m1"]
+
+def test_generation_config_reaches_the_model_and_keys_the_cache(tmp_path, monkeypatch):
+    client = _FakeClient()
+    seen = []
+    fake = client.models.generate_content
+
+    def generate_content(model, contents, **kwargs):
+        seen.append(kwargs.get("config"))
+        return fake(model, contents, **kwargs)
+
+    client.models.generate_content = generate_content
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=60))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    plain = {"temperature": 0}
+    schema = dict(agent_core._TASK_CONFIGS["explain"])
+    for config in (plain, plain, schema, schema):
+        agent_core._call_gemini_with_fallback("hi", models=["m1"], config=config)
+    # one call per distinct config: the schema is part of the cache key, and is sent as given
+    assert seen == [plain, schema]
+    assert seen[1]["response_schema"] is agent_core._EXPLAIN_SCHEMA
+    # no config (model default temperature) or a sampled one is never cached
+    for config in (None, {"temperature": 0.7}, {"temperature": 0.7}):
+        agent_core._call_gemini_with_fallback("hi", models=["m1"], config=config)
+    assert len(seen) == 5
+
+def test_interactive_wrappers_use_priority_tier(tmp_path, monkeypatch):
+    import asyncio
+    client = _FakeClient()
+    tiers = []
+    fake = client.models.generate_content
+
+    def generate_content(model, contents, **kwargs):
+        tiers.append(kwargs.get("config", {}).get("service_tier"))
+        return fake(model, contents, **kwargs)
+
+    client.models.generate_content = generate_content
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "_MODELS_TESTS", ("m1",))
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+
+    async def both():
+        await agent_core.generate_tests_async("x = 1")
+        return [c async for c in agent_core.generate_tests_stream("y = 2")]
+    asyncio.run(both())
+    agent_core.generate_tests("z = 3")
+    assert tiers == ["priority", "priority", "flex"]
+
+def test_prompt_cache_io_runs_off_the_event_loop(tmp_path, monkeypatch):
+    import threading
+    threads = []
+
+    class RecordingCache(agent_core._PromptCache):
+        def get(self, key):
+            threads.append(threading.current_thread().name)
+            return super().get(key)
+
+        def set(self, key, text):
+            threads.append(threading.current_thread().name)
+            super().set(key, text)
+
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", RecordingCache(str(tmp_path / "llm"), ttl=60))
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: _FakeClient())
+    agent_core._call_gemini_with_fallback("hi", models=["m1"], config={"temperature": 0})
+    assert len(threads) == 2 and "techguru-genai" not in threads
+
+def test_many_snippets_are_answered_by_one_call(tmp_path, monkeypatch):
+    import asyncio
+    client = _FakeClient()
+    configs = []
+
+    def generate_content(model, contents, **kwargs):
+        configs.append(kwargs.get("config"))
+        if "=== INPUT 2 ===" in contents:
+            return SimpleNamespace(text=json.dumps([{"summary": "first"}, {"summary": "second"}]))
+        return SimpleNamespace(text=json.dumps({"summary": "single"}))
+
+    client.models.generate_content = generate_content
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    monkeypatch.setattr(agent_core, "_make_genai_client", lambda api_key: client)
+    monkeypatch.setattr(agent_core, "_get_semantic_cache", lambda: None)
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    out = asyncio.run(agent_core.explain_code_many_async([("a = 1", "python"), ("b = 2", "go")]))
+    assert out == [{"summary": "first"}, {"summary": "second"}] and len(configs) == 1
+    schema = configs[0]["response_schema"]
+    assert schema["type"] == "ARRAY" and schema["items"] is agent_core._EXPLAIN_SCHEMA
+    # an answer that can't be matched to the inputs falls back to one call per snippet
+    configs.clear()
+    out = asyncio.run(agent_core.explain_code_many_async([("a", "python"), ("b", "python"), ("c", "python")]))
+    assert out == [{"summary": "single"}] * 3 and len(configs) == 4
@@ -0,0 +1,122 @@
+# tests/test_code_tools.py
+import pytest
+from app import code_tools
+
+ORIGINAL = "".join(f"line {i}\n" for i in range(1, 11))
+
+DIFF = (
+    "--- a/src/mod.py\n"
+    "+++ b/src/mod.py\n"
+    "@@ -4,3 +4,3 @@\n"
+    " line 4\n"
+    "-line 5\n"
+    "+line five\n"
+    " line 6\n"
+)
+
+@pytest.fixture(params=["unidiff", "patch"])
+def backend(request, monkeypatch):
+    if request.param == "unidiff" and not code_tools.HAS_UNIDIFF:
+        pytest.skip("unidiff not installed")
+    monkeypatch.setattr(code_tools, "HAS_UNIDIFF", request.param == "unidiff")
+    return request.param
+
+def test_apply_unified_diff_keeps_untouched_lines(tmp_path, backend):
+    (tmp_path / "src").mkdir()
+    target = tmp_path / "src" / "mod.py"
+    target.write_text(ORIGINAL)
+    assert code_tools.apply_unified_diff(str(tmp_path), DIFF)
+    assert target.read_text() == ORIGINAL.replace("line 5\n", "line five\n")
+
+def test_apply_unified_diff_rejects_mismatched_context(tmp_path, backend):
+    (tmp_path / "src").mkdir()
+    target = tmp_path / "src" / "mod.py"
+    target.write_text(ORIGINAL.replace("line 4\n", "changed\n"))
+    assert not code_tools.apply_unified_diff(str(tmp_path), DIFF)
+
+def test_run_pytest_sees_source_changes_between_runs(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "__init__.py").write_text("")
+    (tmp_path / "src" / "calc.py").write_text("def add(a, b):\n    return a + b\n")
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "conftest.py").write_text(
+        "import os, sys\nsys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))\n"
+    )
+    (tmp_path / "tests" / "test_calc.py").write_text(
+        "from src.calc import add\n\ndef test_add():\n    assert add(2, 2) == 4\n"
+    )
+    code, out = code_tools.run_pytest(str(tmp_path))
+    assert code == 0, out
+    (tmp_path / "src" / "calc.py").write_text("def add(a, b):\n    return a - b - 1\n")
+    code, out = code_tools.run_pytest(str(tmp_path))
+    assert code == 1, out
+
+def test_run_pytest_async_matches_sync(tmp_path):
+    import asyncio
+    (tmp_path / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+    code, out = asyncio.run(code_tools.run_pytest_async(str(tmp_path)))
+    assert code == 0 and "1 passed" in out
+    assert asyncio.run(code_tools.run_pytest_async(str(tmp_path / "missing")))[0] == 1
+
+def test_run_pytest_async_starts_pool_off_the_event_loop(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    pool = code_tools._get_pool()
+    threads = []
+    def get_pool():
+        threads.append(threading.current_thread())
+        return pool
+    monkeypatch.setattr(code_tools, "_pool", None)
+    monkeypatch.setattr(code_tools, "_get_pool", get_pool)
+    (tmp_path / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+    assert asyncio.run(code_tools.run_pytest_async(str(tmp_path)))[0] == 0
+    assert threads and threads[0] is not threading.main_thread()
+
+def test_run_pytest_puts_project_root_on_path(tmp_path):
+    # no conftest.py: the project's src package must still be importable from its tests
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "__init__.py").write_text("")
+    (tmp_path / "src" / "main.py").write_text("def main():\n    return 42\n")
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_main.py").write_text("from src.main import main\n\ndef test_main():\n    assert main() == 42\n")
+    code, out = code_tools.run_pytest(str(tmp_path))
+    assert code == 0, out
+
+def test_run_pytest_timeout_only_takes_down_its_worker(tmp_path, monkeypatch):
+    import asyncio
+    monkeypatch.setattr(code_tools, "PYTEST_TIMEOUT", 1)
+    monkeypatch.setattr(code_tools, "PYTEST_KILL_GRACE", 1)
+    (tmp_path / "hangs").mkdir()
+    (tmp_path / "hangs" / "test_hang.py").write_text("import time\n\ndef test_hang():\n    time.sleep(60)\n")
+    (tmp_path / "quick").mkdir()
+    (tmp_path / "quick" / "test_ok.py").write_text("def test_ok():\n    assert True\n")
+    pool = code_tools._get_pool()
+
+    async def both():
+        return await asyncio.gather(code_tools.run_pytest_async(str(tmp_path / "hangs")),
+                                    code_tools.run_pytest_async(str(tmp_path / "quick")))
+    hung, ok = asyncio.run(both())
+    assert hung[0] == 2 and "timed out" in hung[1]
+    assert ok[0] == 0, ok[1]
+    # the pool was not torn down and still serves runs
+    assert code_tools._get_pool() is pool
+    assert code_tools.run_pytest(str(tmp_path / "quick"))[0] == 0
+
+@pytest.mark.parametrize("diff", [
+    "--- a/../victim.txt\n+++ b/../victim.txt\n@@ -1 +1 @@\n-keep\n+owned\n",
+    "--- a/../victim.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-keep\n",
+])
+def test_apply_unified_diff_stays_inside_root(tmp_path, backend, diff):
+    root = tmp_path / "project"
+    root.mkdir()
+    victim = tmp_path / "victim.txt"
+    victim.write_text("keep\n")
+    assert not code_tools.apply_unified_diff(str(root), diff)
+    assert victim.read_text() == "keep\n"
+
+def test_apply_unified_diff_honours_no_newline_marker(tmp_path, backend):
+    target = tmp_path / "f.txt"
+    target.write_text("a\nb\n")
+    diff = "--- a/f.txt\n+++ b/f.txt\n@@ -1,2 +1,2 @@\n a\n-b\n+c\n\\ No newline at end of file\n"
+    assert code_tools.apply_unified_diff(str(tmp_path), diff)
+    assert target.read_text() == "a\nc"
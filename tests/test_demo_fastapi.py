@@ -0,0 +1,204 @@
+# tests/test_demo_fastapi.py
+import json
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+from app import agent_core
+from demo import demo_fastapi
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # no API key: agent calls answer with the offline stub
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    monkeypatch.setattr(agent_core, "_PROMPT_CACHE", agent_core._PromptCache(str(tmp_path / "llm"), ttl=0))
+    demo_fastapi._RESULT_CACHE.clear()
+    with TestClient(demo_fastapi.app) as c:
+        yield c
+
+def test_agent_endpoints_use_async_api(client, monkeypatch):
+    async def fake_explain(code, lang="python"):
+        return {"summary": code, "lang": lang}
+    monkeypatch.setattr(agent_core, "explain_code_async", fake_explain)
+    r = client.post("/explain", json={"code": "x = 1", "lang": "go"})
+    assert r.status_code == 200
+    assert r.json() == {"summary": "x = 1", "lang": "go"}
+
+def test_app_restarts_after_lifespan_shutdown(client):
+    with TestClient(demo_fastapi.app) as again:
+        assert again.post("/bughunt", json={"code": "x = 1"}).status_code == 200
+
+def test_batcher_merges_concurrent_requests_into_one_call():
+    import asyncio
+    calls = []
+    async def handler(items):
+        calls.append(items)
+        await asyncio.sleep(0)
+        return [{"code": code} for code, _ in items]
+    batcher = demo_fastapi._RequestBatcher(handler, max_batch_size=2, max_queue_time=0.01)
+    async def main():
+        return await asyncio.gather(*(batcher.submit((code, "python")) for code in ["a", "b", "a", "a", "c"]))
+    results = asyncio.run(main())
+    assert [r["code"] for r in results] == ["a", "b", "a", "a", "c"]
+    # first batch (size-triggered at 2 distinct items) is a, b; the repeats of a and c go in the
+    # second (timer-triggered) one
+    assert calls == [[("a", "python"), ("b", "python")], [("a", "python"), ("c", "python")]]
+
+def test_text_chunker_emits_mtu_sized_chunks():
+    import asyncio
+    async def collect(text, **kwargs):
+        return [bytes(c) async for c in demo_fastapi._text_chunker(text, **kwargs)]
+    chunks = asyncio.run(collect("x" * 3000))
+    assert [len(c) for c in chunks] == [1400, 1400, 200]
+    assert asyncio.run(collect("abcdef", chunk_size=4)) == [b"abcd", b"ef"]
+    # chunk boundaries are in bytes; multi-byte characters may be split across chunks
+    assert b"".join(asyncio.run(collect("h\u00e9llo", chunk_size=2))).decode("utf-8") == "h\u00e9llo"
+
+def test_stream_endpoint_pipes_agent_output(client):
+    r = client.post("/stream", json={"mode": "explain", "payload": {"code": "x = 1"}})
+    assert r.status_code == 200 and r.text.startswith("[FALLBACK]")
+    r = client.post("/stream", json={"mode": "bughunt", "payload": {"code": "x = 1"}})
+    assert "issues" in json.loads(r.text)
+
+def test_repeat_requests_served_from_result_cache(client, monkeypatch):
+    calls = []
+    async def fake_bughunt(code):
+        calls.append(code)
+        return {"issues": [], "patch": ""} if code != "broken" else {"raw_text": "[GENAI ERROR] quota"}
+    monkeypatch.setattr(agent_core, "bug_hunt_and_fix_async", fake_bughunt)
+    for code in ["x = 1", "x = 1", "broken", "broken"]:
+        assert client.post("/bughunt", json={"code": code}).status_code == 200
+    # errors are not cached
+    assert calls == ["x = 1", "broken", "broken"]
+
+def test_json_responses_gzipped_but_stream_is_not(client, monkeypatch):
+    async def fake_explain(code, lang="python"):
+        return {"summary": code * 200}
+    monkeypatch.setattr(agent_core, "explain_code_async", fake_explain)
+    r = client.post("/explain", json={"code": "x = 1"}, headers={"Accept-Encoding": "gzip"})
+    assert r.headers.get("content-encoding") == "gzip"
+    r = client.post("/stream", json={"mode": "bughunt", "payload": {"code": "x = 1" * 200}},
+                    headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+def test_root_page_is_prebuilt_and_cacheable(client):
+    first = client.get("/")
+    second = client.get("/")
+    assert first.status_code == second.status_code == 200
+    assert first.text == second.text and "TechGuru" in first.text
+    assert first.headers["cache-control"] == "public, max-age=3600"
+
+def test_scaffold_writes_every_root(client, tmp_path, monkeypatch):
+    roots = [tmp_path / "demo" / "proj", tmp_path / "data" / "proj"]
+    monkeypatch.setattr(demo_fastapi, "_scaffold_roots", lambda name: [str(r) for r in roots])
+    r = client.post("/scaffold", json={"project_name": "proj"})
+    assert r.status_code == 200
+    for root in roots:
+        assert (root / "src" / "main.py").read_text().startswith("def main()")
+        assert (root / ".github" / "workflows" / "ci.yml").exists()
+
+def test_stream_body_parsed_leniently(client):
+    # malformed / non-object bodies fall back to the default mode (explain) with no payload
+    for raw in [b"", b"not json", b"[1, 2]"]:
+        r = client.post("/stream", content=raw, headers={"Content-Type": "application/json"})
+        assert r.status_code == 200 and r.text.startswith("[FALLBACK]")
+
+def test_images_served_with_cache_headers(client):
+    r = client.get("/images/logo_1.png")
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+    if demo_fastapi.HAS_SERVESTATIC:
+        assert "max-age=86400" in r.headers["cache-control"] and "etag" in r.headers
+    assert client.get("/images/missing.png").status_code == 404
+
+def _flat_routes(routes):
+    for route in routes:
+        included = getattr(route, "original_router", None)  # include_router() entries
+        if included is not None:
+            yield from _flat_routes(included.routes)
+        else:
+            yield route
+
+def test_each_route_registered_once():
+    seen = [(route.path, method) for route in _flat_routes(demo_fastapi.app.routes)
+            for method in getattr(route, "methods", None) or ["MOUNT"]]
+    assert len(seen) == len(set(seen))
+    assert ("/explain", "POST") in seen
+
+def test_create_app_without_static_mounts():
+    app = demo_fastapi.create_app(serve_static=False)
+    paths = {route.path for route in _flat_routes(app.routes)}
+    assert "/explain" in paths and "/" in paths
+    assert not paths & {"/static", "/images", "/chat"}
+    with TestClient(app) as c:
+        assert "<h1>TechGuru</h1>" in c.get("/").text
+
+def test_oversize_bodies_rejected_with_413(client):
+    big = "x" * (demo_fastapi.MAX_BODY_BYTES + 1)
+    r = client.post("/explain", json={"code": big})
+    assert r.status_code == 413
+    # chunked uploads without Content-Length are counted as they arrive, on every route
+    for path in ("/stream", "/explain"):
+        r = client.post(path, content=(b"x" * 4096 for _ in range(20)))
+        assert r.status_code == 413, path
+    r = client.post("/explain", content=(b'{"code": "x = 1"}' for _ in range(1)),
+                    headers={"content-type": "application/json"})
+    assert r.status_code == 200
+    assert client.post("/explain", json={"code": "x = 1"}).status_code == 200
+
+def test_make_dirs_creates_each_directory_once(tmp_path, monkeypatch):
+    import os
+    created = []
+    real_makedirs = os.makedirs
+    def recording_makedirs(path, exist_ok=False):
+        created.append(path)
+        real_makedirs(path, exist_ok=exist_ok)
+    monkeypatch.setattr(demo_fastapi.os, "makedirs", recording_makedirs)
+    root = str(tmp_path / "proj")
+    dirs = [os.path.join(root, "src"), root, os.path.join(root, ".github", "workflows"), os.path.join(root, "src")]
+    demo_fastapi._make_dirs(dirs)
+    # the duplicate src entry is created once, after its parent
+    assert created[:2] == [root, os.path.join(root, "src")]
+    assert created.count(os.path.join(root, "src")) == 1
+    assert all(os.path.isdir(d) for d in dirs)
+
+def test_stream_sets_no_buffering_headers_and_speaks_sse(client):
+    body = {"mode": "scaffold", "payload": {"project_name": "proj"}}
+    r = client.post("/stream", json=body)
+    assert r.headers["x-accel-buffering"] == "no" and r.headers["cache-control"] == "no-cache"
+    assert r.text.startswith("Scaffolded files:\n")
+    r = client.post("/stream", json=body, headers={"Accept": "text/event-stream"})
+    assert r.headers["content-type"].startswith("text/event-stream")
+    assert r.text.startswith("data: Scaffolded files:\ndata: proj/README.md\n") and r.text.endswith("\n\n")
+
+def test_failures_return_error_id_and_log_traceback(client, monkeypatch):
+    import logging
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    demo_fastapi.log.addHandler(handler)
+    async def broken(code, lang="python"):
+        raise RuntimeError("secret internals")
+    monkeypatch.setattr(agent_core, "explain_code_async", broken)
+    try:
+        error = client.post("/explain", json={"code": "boom"}).json()["error"]
+    finally:
+        demo_fastapi.log.removeHandler(handler)
+    assert "secret internals" not in error and "Traceback" not in error
+    error_id = error.rsplit(" ", 1)[1].rstrip(")")
+    assert any(error_id in r.getMessage() and r.exc_info for r in records)
+
+def test_log_records_are_not_queued_without_a_listener(monkeypatch):
+    import logging
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    monkeypatch.setattr(logging.getLogger(), "handlers", [handler])
+    demo_fastapi.log.error("outside the lifespan")
+    assert demo_fastapi._log_queue.empty()
+    assert [r.getMessage() for r in records] == ["outside the lifespan"]
+    with TestClient(demo_fastapi.app):
+        assert demo_fastapi.log.propagate is False
+    assert demo_fastapi.log.propagate is True and demo_fastapi._log_queue.empty()
@@ -0,0 +1,21 @@
+# tests/test_srs_scheduler.py
+import json
+from app import srs_scheduler
+
+def test_schedule_task_upserts_row(tmp_path):
+    db = str(tmp_path / "srs_state.db")
+    srs_scheduler.schedule_task("unit-testing", quality=2, state_file=db)
+    res = srs_scheduler.schedule_task("unit-testing", quality=5, state_file=db)
+    state = srs_scheduler.load_state(db)
+    assert list(state) == ["unit-testing"]
+    assert state["unit-testing"]["last_quality"] == 5
+    assert state["unit-testing"]["next_review"] == res["next_review"]
+
+def test_legacy_json_state_is_imported(tmp_path):
+    legacy = {"edge-cases": {"last_quality": 3, "next_review": "2025-11-19T11:14:41", "scheduled_at": "2025-11-15T11:14:41"}}
+    (tmp_path / "srs_state.json").write_text(json.dumps(legacy))
+    db = str(tmp_path / "srs_state.db")
+    srs_scheduler.schedule_task("unit-testing", quality=2, state_file=db)
+    state = srs_scheduler.load_state(db)
+    assert state["edge-cases"] == legacy["edge-cases"]
+    assert "unit-testing" in state